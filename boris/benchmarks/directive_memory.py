@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Measure the memory footprint of parsed directives.
+
+Builds N directives the way the config parser does (create, give to a
+Config, tokenparser) and reports the bytes allocated per directive, as
+measured by tracemalloc.
+
+Usage: python benchmarks/directive_memory.py [N]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from boristool.common import config, directive, log
+
+
+class BENCH(directive.Directive):
+    """Minimal directive needing no data collectors."""
+
+    __slots__ = ()
+
+    def tokenparser(self, toklist, toktypes, indent):
+        directive.Directive.tokenparser(self, toklist, toktypes, indent)
+        self.state.ID = self.ID
+
+
+def build(n, cfg):
+    directives = []
+    for i in range(n):
+        d = BENCH(['BENCH', 'bench%d' % i, ':'])
+        d.Config = cfg
+        d.scanperiod = config.scanperiod
+        d.tokenparser([['rule', '=', '"loadavg1 > 5"'],
+                       ['scanperiod', '=', '"1m"'],
+                       ['numchecks', '=', '3'],
+                       ['action', '=', '"email(\'root\', \'load high\')"']],
+                      None, 0)
+        cfg.give(d)
+        directives.append(d)
+    return directives
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    log.hostname = 'benchhost'
+    log.loglevel = 0
+    log.adminlevel = 0
+    config.directives['BENCH'] = BENCH
+    cfg = config.Config('__main__')
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    directives = build(n, cfg)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    print("%d directives, %d bytes total, %d bytes per directive" %
+          (len(directives), total, total // n))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,43 @@ if PY3:
     string_types = (str,)
     unichr = chr
     long = int
+    intern = sys.intern
 else:
     text_type = unicode
     string_types = (str, unicode)
     unichr = unichr
     long = long
+    intern = intern
+
+try:
+    from functools import lru_cache
+except ImportError:
+    def lru_cache(maxsize=128):
+        """Minimal stand-in for functools.lru_cache: the cache is emptied
+        when it reaches maxsize rather than evicting the oldest entry."""
+
+        def decorator(func):
+            cache = {}
+
+            def wrapper(*args):
+                try:
+                    return cache[args]
+                except KeyError:
+                    pass
+                if len(cache) >= maxsize:
+                    cache.clear()
+                result = cache[args] = func(*args)
+                return result
+            wrapper.cache_clear = cache.clear
+            return wrapper
+        return decorator
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    from types import MappingProxyType
+except ImportError:
+    MappingProxyType = dict        # no read-only mapping type, a copy will do
@@ -15,6 +15,7 @@ from __future__ import absolute_import
 
 import re
 
+from boristool._compat import quote
 from boristool.common import datacollect, log, utils
 
 
@@ -50,13 +51,10 @@ class dfList(datacollect.DataCollect):
         try:
             r = datacollect.DataCollect.__getitem__(*(self, name))
         except KeyError:
-            self.data_semaphore.acquire()        # thread-safe access to self.data
             try:
-                r = self.data.mounthash[name]        # try to find mount point
+                r = self.snapshot.mounthash[name]        # try to find mount point
             except KeyError:
-                self.data_semaphore.release()
                 raise KeyError("Key %s not found in data hashes" % (name))
-            self.data_semaphore.release()
 
         return r
 
@@ -66,21 +64,51 @@ class dfList(datacollect.DataCollect):
         Collect disk usage data.
         """
         # Get information about all local filesystems from 'df'.
-        rawList = utils.safe_popen('/bin/df -l -k', 'r')
-        rawList.readline()                        # skip header
-
         self.data.datahash = {}
         self.data.mounthash = {}
 
+        for p in self._df('/bin/df -l -k'):
+            self._store(p)
+
+        log.log("<df>dfList.collectData(): filesystem data collected", 7)
+
+    def collectKey(self, name):
+        """
+        Refresh the usage of the single filesystem name, a device or mount
+        point, by running 'df' for its mount point only.
+        Return False if name is not a known filesystem.
+        """
+
+        try:
+            p = self.data.datahash.get(name) or self.data.mounthash[name]
+        except (AttributeError, KeyError):
+            return False
+
+        rows = self._df('/bin/df -l -k ' + quote(p.raw[-1]))
+        if len(rows) != 1:
+            return False
+        self._store(rows[0])
+
+        log.log("<df>dfList.collectKey(): filesystem data collected for %s" % (name), 7)
+        return True
+
+    def _df(self, cmd):
+        """Run the df command cmd and return a df object for each filesystem."""
+
+        rawList = utils.safe_popen(cmd, 'r')
+        rawList.readline()                        # skip header
+
+        rows = []
         for line in rawList.readlines():
             fields = line.split()
             if len(fields) == 9:
-                p = df(fields)
-                self.data.datahash[fields[0]] = p        # dictionary of filesystem devices
-                self.data.mounthash[fields[5]] = p        # dictionary of mount points
-
+                rows.append(df(fields))
         utils.safe_pclose(rawList)
-        log.log("<df>dfList.collectData(): filesystem data collected", 7)
+        return rows
+
+    def _store(self, p):
+        self.data.datahash[p.raw[0]] = p        # dictionary of filesystem devices
+        self.data.mounthash[p.raw[5]] = p        # dictionary of mount points
 
 
 # Define single filesystem information objects.
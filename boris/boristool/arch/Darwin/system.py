@@ -45,8 +45,22 @@ class system(datacollect.DataCollect):
         ctr_pages_reactivated                   - (long)
         ctr_pageins                             - (long)
         ctr_pageouts                            - (long)
+
+    Each command is only called if a directive uses one of its stats (see
+    DataCollect.needs()).
+
+    The ctr_ counters also have _delta and _rate stats, eg:
+    ctr_pageins_rate (see DataCollect).
     """
 
+    VMSTAT_FIELDS = ('pages_free', 'pages_active', 'pages_inactive', 'pages_wired_down',
+                     'ctr_translation_faults', 'ctr_pages_copyonwrite', 'ctr_pages_zero_filled',
+                     'ctr_pages_reactivated', 'ctr_pageins', 'ctr_pageouts')
+    UPTIME_FIELDS = ('uptime', 'users', 'loadavg1', 'loadavg5', 'loadavg15')
+
+    costs = dict([(f, 5) for f in VMSTAT_FIELDS + UPTIME_FIELDS])
+    counters = tuple([f for f in VMSTAT_FIELDS if f.startswith('ctr_')])
+
     def __init__(self):
         super(system, self).__init__()
 
@@ -63,13 +77,15 @@ class system(datacollect.DataCollect):
 
         self.data.datahash = {}                # dict of system data
 
-        vmstat_dict = self._getvmstat()
-        if vmstat_dict:
-            self.data.datahash.update(vmstat_dict)
+        if self.needs(self.data.datahash, *self.VMSTAT_FIELDS):
+            vmstat_dict = self._getvmstat()
+            if vmstat_dict:
+                self.data.datahash.update(vmstat_dict)
 
-        uptime_dict = self._getuptime()
-        if uptime_dict:
-            self.data.datahash.update(uptime_dict)
+        if self.needs(self.data.datahash, *self.UPTIME_FIELDS):
+            uptime_dict = self._getuptime()
+            if uptime_dict:
+                self.data.datahash.update(uptime_dict)
 
         log.log("<system>system.collectData(): collected data for %d system statistics" %
                 (len(self.data.datahash.keys())), 6)
@@ -8,7 +8,14 @@ from psutil import disk_io_counters
 
 
 class DiskStatistics(datacollect.DataCollect):
-        """Collects disk statistics using psutil.disk_io_counters()"""
+        """Collects disk statistics using psutil.disk_io_counters()
+
+        The stats are counters, so each also has _delta and _rate stats,
+        eg: read_bytes_rate (see DataCollect).
+        """
+
+        counters = ('read_count', 'write_count', 'read_bytes', 'write_bytes',
+                    'read_time', 'write_time')
 
         def __init__(self):
             super(DiskStatistics, self).__init__()
@@ -28,14 +35,15 @@ class DiskStatistics(datacollect.DataCollect):
                     self.data.datahash[name] = disk
                 self.data.numdisks += 1
 
-                for attrname in ['read_count', 'write_count',
-                                 'read_bytes', 'write_bytes',
-                                 'read_time', 'write_time']:
+                for attrname in self.counters:
                     disk.set_stat(attrname, getattr(disk_stats[name], attrname))
 
             log.log("<diskdevice>DiskStatistics.collectData(): Collected stats for %d disks" %
                     (self.data.numdisks), 6)
 
+        def counterRows(self):
+            return [(name, disk.stats) for (name, disk) in self.data.datahash.items()]
+
 
 class Disk:
     """Holds information about a raw disk.
@@ -53,8 +53,24 @@ class system(datacollect.DataCollect):
         pages_used                              - (int)
         pages_total                             - (int)
         pages_available                         - (int)
+
+    Only the stats used by the directives are collected (see
+    DataCollect.needs()); users parses utmp so it costs the most.
+
+    The ctr_ counters also have _delta and _rate stats, eg:
+    ctr_pageins_rate (see DataCollect).
     """
 
+    VM_FIELDS = ('pages_free', 'pages_used', 'pages_total', 'pages_available', 'pages_active',
+                 'pages_inactive', 'pages_wired_down', 'pages_cached')
+    SWAP_FIELDS = ('ctr_pageins', 'ctr_pageouts')
+    LOADAVG_FIELDS = ('loadavg1', 'loadavg5', 'loadavg15')
+
+    costs = dict([(f, 2) for f in VM_FIELDS + SWAP_FIELDS] +
+                 [(f, 1) for f in LOADAVG_FIELDS] +
+                 [('uptime', 2), ('users', 10)])
+    counters = SWAP_FIELDS
+
     def __init__(self):
         super(system, self).__init__()
 
@@ -89,23 +105,25 @@ class system(datacollect.DataCollect):
         vmstat_dict = {}
 
         ps = getpagesize()
-        vm = psutil.virtual_memory()
-        vmstat_dict['pages_free'] = vm.free//ps
-        vmstat_dict['pages_used'] = vm.used//ps
-        vmstat_dict['pages_total'] = vm.total//ps
-        vmstat_dict['pages_available'] = vm.available//ps
-        if hasattr(vm, 'active'):
-            vmstat_dict['pages_active'] = vm.active//ps
-        if hasattr(vm, 'inactive'):
-            vmstat_dict['pages_inactive'] = vm.inactive//ps
-        if hasattr(vm, 'wired'):
-            vmstat_dict['pages_wired_down'] = vm.wired//ps
-        if hasattr(vm, 'cached'):
-            vmstat_dict['pages_cached'] = vm.cached//ps
-
-        sm = psutil.swap_memory()
-        vmstat_dict['ctr_pageins'] = sm.sin//ps
-        vmstat_dict['ctr_pageouts'] = sm.sout//ps
+        if self.needs(vmstat_dict, *self.VM_FIELDS):
+            vm = psutil.virtual_memory()
+            vmstat_dict['pages_free'] = vm.free//ps
+            vmstat_dict['pages_used'] = vm.used//ps
+            vmstat_dict['pages_total'] = vm.total//ps
+            vmstat_dict['pages_available'] = vm.available//ps
+            if hasattr(vm, 'active'):
+                vmstat_dict['pages_active'] = vm.active//ps
+            if hasattr(vm, 'inactive'):
+                vmstat_dict['pages_inactive'] = vm.inactive//ps
+            if hasattr(vm, 'wired'):
+                vmstat_dict['pages_wired_down'] = vm.wired//ps
+            if hasattr(vm, 'cached'):
+                vmstat_dict['pages_cached'] = vm.cached//ps
+
+        if self.needs(vmstat_dict, *self.SWAP_FIELDS):
+            sm = psutil.swap_memory()
+            vmstat_dict['ctr_pageins'] = sm.sin//ps
+            vmstat_dict['ctr_pageouts'] = sm.sout//ps
 
         return vmstat_dict
 
@@ -115,12 +133,15 @@ class system(datacollect.DataCollect):
 
         uptime_dict = {}
 
-        loadavg = os.getloadavg()
         # convert types
-        uptime_dict['uptime'] = str(datetime.now() - datetime.fromtimestamp(psutil.boot_time()))
-        uptime_dict['users'] = len(psutil.users())
-        uptime_dict['loadavg1'] = float(Decimal(loadavg[0]).quantize(Decimal('0.01')))
-        uptime_dict['loadavg5'] = float(Decimal(loadavg[1]).quantize(Decimal('0.01')))
-        uptime_dict['loadavg15'] = float(Decimal(loadavg[2]).quantize(Decimal('0.01')))
+        if self.needs(uptime_dict, 'uptime'):
+            uptime_dict['uptime'] = str(datetime.now() - datetime.fromtimestamp(psutil.boot_time()))
+        if self.needs(uptime_dict, 'users'):
+            uptime_dict['users'] = len(psutil.users())
+        if self.needs(uptime_dict, *self.LOADAVG_FIELDS):
+            loadavg = os.getloadavg()
+            uptime_dict['loadavg1'] = float(Decimal(loadavg[0]).quantize(Decimal('0.01')))
+            uptime_dict['loadavg5'] = float(Decimal(loadavg[1]).quantize(Decimal('0.01')))
+            uptime_dict['loadavg15'] = float(Decimal(loadavg[2]).quantize(Decimal('0.01')))
 
         return uptime_dict
@@ -109,6 +109,14 @@ def sig_handler(sig, frame):
         stop_threads()
         boris_exit()
 
+    elif 'SIGUSR1' in dir(signal) and sig == signal.SIGUSR1:
+        # SIGUSR1 - log the data collector stats
+        log.log('<boris>sig_handler(): SIGUSR1 encountered - data collector stats:', 1)
+        data_modules = getattr(directive, 'data_modules', None)
+        if data_modules is not None:
+            for line in data_modules.statsDump():
+                log.log('<boris>sig_handler(): %s' % (line), 1)
+
     elif 'SIGALRM' in dir(signal) and sig == signal.SIGALRM:
         # SIGALRM (Alarm) - return to force a continue
         return
@@ -241,7 +249,7 @@ def main():
     log.version = __version__
 
     # Catch the most important signals
-    for sig in ('SIGALRM', 'SIGHUP', 'SIGINT', 'SIGTERM'):
+    for sig in ('SIGALRM', 'SIGHUP', 'SIGINT', 'SIGTERM', 'SIGUSR1'):
         if sig in dir(signal):
             signal.signal(eval("signal.%s" % (sig)), sig_handler)
 
@@ -309,6 +317,10 @@ def main():
     cargs = (boris_cfg, please_die, config.consport)
     start_threads(sargs, cargs)
 
+    # Start collectors refreshing on schedule: publishing to directives in
+    # push mode, or prefetching
+    data_modules.start_schedulers(boris_cfg, please_die)
+
     while not please_die.isSet():
         try:
             log.log("<boris>main(): Threads in use = %d." % (threading.activeCount()), 8)
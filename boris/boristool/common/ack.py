@@ -7,6 +7,8 @@ import time
 class ack:
     """The ack(nowledgement) class to keep state of last acknowledgement."""
 
+    __slots__ = ('state', 'time', 'user', 'details')
+
     def __init__(self):
         self.clear()
 
@@ -14,7 +16,7 @@ class ack:
         """Clear all acknowledgement information."""
 
         self.state = "n"        # acknowledged or not, "y" or "n"
-        self.time = None        # time of acknowledgement
+        self.time = None        # time of acknowledgement (epoch seconds)
         self.user = None        # user who acknowledged
         self.details = None        # other details
 
@@ -24,6 +26,6 @@ class ack:
         self.clear()                # clear any previous ack first
 
         self.state = "y"        # acknowledged
-        self.time = time.localtime(time.time())
+        self.time = time.time()
         self.user = user
         self.details = details
@@ -38,6 +38,9 @@ class action:
     an Boris action, called from directive arguments such as 'action'
     and 'act2ok'."""
 
+    __slots__ = ('runcount', 'varDict', 'state', 'aliasDict', 'actionReports',
+                 'notif', 'msg', 'level', 'MDict', 'storedict')
+
     def __init__(self):
         self.runcount = 0        # chris 2002-12-29: count consecutive action calls
 
@@ -178,7 +181,7 @@ class action:
                     agestr = agestr + "s"
             if agestr != "":
                 self.varDict['problemage'] = agestr
-            self.varDict['problemfirstdetect'] = "First detected: %04d/%02d/%02d %d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
+            self.varDict['problemfirstdetect'] = "First detected: %s" % utils.format_time(t)
 
         # run thru utils.parse_vars() to substitute variables from varDict
         address = utils.parse_vars(address, self.varDict)
@@ -0,0 +1,182 @@
+
+from __future__ import absolute_import
+
+__doc__ = """Compiled directive action lists.
+
+Directive action arguments (action, act2ok, actelse) are lists of action
+call strings, either direct calls of action methods, eg:
+
+    email('root', 'disk full')
+
+or notification references, notif(msg[,level]), naming an N definition
+whose level holds the calls to make and an M/MSG tree the calls can refer
+to by name.
+
+Rather than matching, splitting and eval()ing these strings every time
+actions fire, each string is compiled once per Config into an ActionStep:
+the notification, M tree and level looked up, and each call resolved to
+the action method and its argument values.  Firing an action is then a
+direct method call.  Calls which cannot be resolved this way (eg: with
+arguments that are expressions) are compiled to code objects evaluated
+in the same environment as before.
+"""
+
+import ast
+import re
+
+from . import action
+from . import log
+from . import utils
+
+
+# notif(msg[,level]) - a Notification reference rather than an action call
+NOTIFICATION = re.compile(r"([A-Za-z0-9_]+)\(([A-Za-z0-9_.]+),?([0-9]?)\)")
+
+
+class ActionCall(object):
+    """One action call, resolved to the action method and its arguments
+    if possible, otherwise compiled for eval()."""
+
+    __slots__ = ('text', 'func', 'args', 'kwargs', 'code', 'env')
+
+    def __init__(self, text, msgs, aliasDict):
+        self.text = text
+        self.func = None
+        self.args = ()
+        self.kwargs = {}
+        self.code = None
+        self.env = (msgs, aliasDict)        # names the call arguments may refer to
+
+        if not self.resolve():
+            self.code = compile("_Action.%s" % (text.strip()), '<action>', 'eval')
+
+    def __call__(self, Action):
+        """Call the action for Action, the directive action object."""
+
+        if self.func is not None:
+            return self.func(Action, *self.args, **self.kwargs)
+        env = utils.VarContext({'_Action': Action}, *self.env)
+        return eval(self.code, {"__builtins__": {}}, env)
+
+    def __repr__(self):
+        return self.text
+
+    def resolve(self):
+        """Resolve the call to an action method with argument values.
+        Return False if the call cannot be resolved."""
+
+        try:
+            call = ast.parse(self.text.strip(), mode='eval').body
+        except SyntaxError:
+            return False
+        if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+            return False
+        if call.func.id.startswith('_'):
+            return False
+        func = getattr(action.action, call.func.id, None)
+        if not callable(func):
+            return False
+
+        try:
+            args = [self.value(a) for a in call.args]
+            kwargs = dict([(k.arg, self.value(k.value)) for k in call.keywords])
+        except (KeyError, ValueError, TypeError, SyntaxError):
+            return False
+        if None in kwargs:
+            return False        # **kwargs
+
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = kwargs
+        return True
+
+    def value(self, node):
+        """The value of an argument: a literal or a MSG/ALIAS name."""
+
+        if isinstance(node, ast.Name) and node.id not in ('True', 'False', 'None'):
+            for names in self.env:
+                if names is not None and node.id in names:
+                    return names[node.id]
+            raise KeyError(node.id)
+        return ast.literal_eval(node)
+
+
+class ActionStep(object):
+    """One element of a directive action list: a list of ActionCalls and,
+    for a notification reference, the notification details the action
+    object is given before the calls are made."""
+
+    __slots__ = ('text', 'calls', 'notif', 'msg', 'level', 'MDict')
+
+    def __init__(self, text):
+        self.text = text
+        self.calls = ()
+        self.notif = None
+        self.msg = None
+        self.level = None
+        self.MDict = None
+
+
+def compileStep(text, Config):
+    """Return the ActionStep for action string text, resolving names in
+    Config; or None if it refers to an undefined notification level."""
+
+    step = ActionStep(text)
+
+    inx = NOTIFICATION.search(text)
+    if inx is None:
+        # Assume we have a simple action call (rather than a
+        # notification definition.
+        step.calls = (ActionCall(text, None, Config.aliasDict),)
+        return step
+
+    # Using a Notification object
+    notif = inx.group(1)
+    msg = inx.group(2)
+    level = inx.group(3)
+    if level is None or level == '':
+        level = '0'
+
+    try:
+        # Get the actions to execute from the given Level of the N object
+        afunc = Config.NDict[notif].levels[level]
+    except KeyError:
+        log.log("<actionplan>compileStep(): Config.NDict[notif].levels[level], notif=%s level=%s"
+                % (notif, level), 5)
+        return None
+
+    step.notif = notif
+    step.msg = msg
+    step.level = level
+    step.MDict = Config.MDict
+
+    # Get M group needed for this action
+    msgs = None
+    try:
+        msgtree = msg.split('.')
+        M = Config.MDict[msgtree[0]]
+        for m in msgtree[1:]:
+            M = M[m]
+        msgs = M.MDict
+    except (KeyError, TypeError, AttributeError):
+        log.log("<actionplan>compileStep(): M '%s' not found for %s" % (msg, text), 5)
+
+    step.calls = tuple([ActionCall(a, msgs, Config.aliasDict)
+                        for a in utils.tricky_split(afunc[0], ',')])
+    return step
+
+
+def plan(Config, actionList):
+    """Return the list of ActionSteps for actionList, compiling any action
+    strings not yet compiled for Config.  Steps which failed to compile
+    are None."""
+
+    plans = Config.actionPlans
+    steps = []
+    for a in actionList:
+        try:
+            step = plans[a]
+        except KeyError:
+            step = plans[a] = compileStep(a, Config)
+        steps.append(step)
+    return steps
@@ -59,7 +59,7 @@ def notify(self, subject="", body=""):
                 agestr = agestr + "s"
         if agestr != "":
             self.varDict['problemage'] = agestr
-        self.varDict['problemfirstdetect'] = "First detected: %04d/%02d/%02d %d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
+        self.varDict['problemfirstdetect'] = "First detected: %s" % utils.format_time(t)
 
     # run thru utils.parse_vars() to substitute variables from varDict
     subj = utils.parse_vars(subj, self.varDict)
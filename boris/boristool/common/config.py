@@ -3,6 +3,8 @@ import sys
 import string
 import os
 
+from . import correlate
+from . import datacollect
 from . import directive
 from . import definition
 from . import log
@@ -51,9 +53,13 @@ class Config:
 
         self.aliasDict = {}                        # dictionary of ALIASes
         self.NDict = {}                                # dictionary of Notification definitions
-        self.classDict = {}                        # dictionary of Class definitions
+        self.classDict = {}                        # dictionary of Class definitions (sets of hosts)
+        self.templateCache = {}                # template Args resolved in this group, by name
+        self.actionPlans = {}                # compiled action strings, see actionplan.plan()
+        self.templateNameCache = None        # see templateNames()
 
         self.groups = []
+        self.groupsByName = {}                # sub-groups of this group, by name
         self.configfiles = {}                        # dictionary of config file mtimes
 
         # Inherit parent properties if given
@@ -81,6 +87,31 @@ class Config:
         str = str + "\n>"
         return str
 
+    def templateNames(self):
+        """Return the set of variable names the messages, notifications and
+        aliases of this group refer to (see utils.template_names())."""
+
+        if self.templateNameCache is not None:
+            return self.templateNameCache
+
+        texts = [v for v in self.aliasDict.values() if isinstance(v, str)]
+        for n in self.NDict.values():
+            for level in n.levels.values():
+                texts.extend([a for a in level if isinstance(a, str)])
+        msgs = [self.MDict[m] for m in self.MDict.keys()]
+        while msgs:
+            m = msgs.pop()
+            if m.type == 'M':
+                msgs.extend(m.MDict.values())
+            else:
+                texts.extend([t for t in (m.subject, m.message) if t])
+
+        names = set()
+        for t in texts:
+            names.update(utils.template_names(t))
+        self.templateNameCache = names
+        return names
+
     def newgroup(self, tokcolist, toktypes, parent=None):
         """Add new rules group."""
 
@@ -98,11 +129,10 @@ class Config:
         groupname = tokcolist[1]
 
         # duplicate group names not allowed at same level
-        for i in parent.groups:
-            if groupname == i.name:
-                log.log("<config>newgroup(): merging group %s with previous definition"
-                        % (groupname), 8)
-                return i
+        if groupname in parent.groupsByName:
+            log.log("<config>newgroup(): merging group %s with previous definition"
+                    % (groupname), 8)
+            return parent.groupsByName[groupname]
 
         # Create new group
         newgroup = Config(groupname, parent)
@@ -110,6 +140,7 @@ class Config:
         # Add to parent's group colist
         if parent is not None:
             parent.groups.append(newgroup)
+            parent.groupsByName[groupname] = newgroup
 
         return newgroup
 
@@ -124,9 +155,9 @@ class Config:
         elif obj.type == 'ALIAS':
             self.aliasDict[obj.name] = obj.value
         elif obj.type == 'CLASS':
-            self.classDict[obj.name] = obj.hosts
-        elif obj.type in directives.keys():
-            if obj.ID in self.groupDirectives.keys():
+            self.classDict[obj.name] = frozenset(obj.hosts)
+        elif obj.type in directives:
+            if obj.ID in self.groupDirectives:
                 raise ParseFailure("Duplicate directive name: %s" % obj.ID)
             # add directive
             self.groupDirectives[obj.ID] = obj
@@ -350,6 +381,116 @@ class NUMTHREADS(ConfigOption):
                 % (num_threads), 8)
 
 
+# RULETIMEOUT - maximum time a directive rule may take to evaluate
+class RULETIMEOUT(ConfigOption):
+    def __init__(self, colist, typecolist):
+        super(RULETIMEOUT, self).__init__(colist, typecolist)
+
+        # if we don't have 3 or 4 elements ['RULETIMEOUT', '=', <int>, [<char>,]] then raise an error
+        if len(colist) < 3 or len(colist) > 4:
+            raise ParseFailure("RULETIMEOUT definition has %d tokens when expecting 3 or 4"
+                               % len(colist))
+
+        # ok, value is 3rd[+4th] colist element
+        if len(colist) == 3:
+            rawval = colist[2]
+        else:
+            rawval = str(colist[2]) + colist[3]
+
+        try:
+            value = float(rawval)
+        except ValueError:
+            try:
+                value = utils.val2secs(rawval)        # convert value to seconds
+            except ValueError:
+                value = None
+        if value is None or value < 0:
+            raise ParseFailure("RULETIMEOUT is not a valid time, '%s'" % (rawval))
+
+        directive.RULETIMEOUT = value                # set the config option
+        log.log("<config>RULETIMEOUT(): ruletimeout set to %s (%s seconds)."
+                % (rawval, directive.RULETIMEOUT), 8)
+
+
+# CORRELATEWINDOW - failures starting within this time are correlated
+class CORRELATEWINDOW(ConfigOption):
+    def __init__(self, colist, typecolist):
+        super(CORRELATEWINDOW, self).__init__(colist, typecolist)
+
+        # if we don't have 3 or 4 elements ['CORRELATEWINDOW', '=', <int>, [<char>,]] then raise an error
+        if len(colist) < 3 or len(colist) > 4:
+            raise ParseFailure("CORRELATEWINDOW definition has %d tokens when expecting 3 or 4"
+                               % len(colist))
+
+        # ok, value is 3rd[+4th] colist element
+        if len(colist) == 3:
+            rawval = colist[2]
+        else:
+            rawval = str(colist[2]) + colist[3]
+
+        try:
+            value = utils.val2secs(str(rawval))        # convert value to seconds
+        except ValueError:
+            value = None
+        if value is None or value < 0:
+            raise ParseFailure("CORRELATEWINDOW is not a valid time, '%s'" % (rawval))
+
+        correlate.WINDOW = value                # set the config option
+        log.log("<config>CORRELATEWINDOW(): correlation window set to %s (%s seconds)."
+                % (rawval, correlate.WINDOW), 8)
+
+
+# MAXSTALE - serve collector data this long after it expires while it is refreshed
+class MAXSTALE(ConfigOption):
+    def __init__(self, colist, typecolist):
+        super(MAXSTALE, self).__init__(colist, typecolist)
+
+        # if we don't have 3 or 4 elements ['MAXSTALE', '=', <int>, [<char>,]] then raise an error
+        if len(colist) < 3 or len(colist) > 4:
+            raise ParseFailure("MAXSTALE definition has %d tokens when expecting 3 or 4"
+                               % len(colist))
+
+        # ok, value is 3rd[+4th] colist element
+        if len(colist) == 3:
+            rawval = colist[2]
+        else:
+            rawval = str(colist[2]) + colist[3]
+
+        try:
+            value = utils.val2secs(str(rawval))        # convert value to seconds
+        except ValueError:
+            value = None
+        if value is None or value < 0:
+            raise ParseFailure("MAXSTALE is not a valid time, '%s'" % (rawval))
+
+        datacollect.MAXSTALE = value                # set the config option
+        log.log("<config>MAXSTALE(): maxstale set to %s (%s seconds)."
+                % (rawval, datacollect.MAXSTALE), 8)
+
+
+class PREFETCH(ConfigOption):
+    """Set the boolean indicating collectors should refresh in the background before their data expires."""
+
+    def __init__(self, colist, typecolist):
+        super(PREFETCH, self).__init__(colist, typecolist)
+
+        # if we don't have 3 elements ['PREFETCH', '=', <val>] then
+        # raise an error
+        if len(colist) != 3:
+            raise ParseFailure("PREFETCH definition has %d tokens when expecting 3" % len(colist))
+
+        # ok, value is 3rd colist element
+        if str(colist[2]) == '1' or str(colist[2]).lower() == 'true' or str(colist[2]).lower() == 'on':
+            datacollect.PREFETCH = True
+        elif str(colist[2]) == '0' or str(colist[2]).lower() == 'false' or str(colist[2]).lower() == 'off':
+            datacollect.PREFETCH = False
+        else:
+            raise ParseFailure("PREFETCH must be True [1/True/on] or False [0/False/off]: '%s'" % (colist[2]))
+
+        log.log("<config>PREFETCH(): prefetch set to '%s'."
+                % (datacollect.PREFETCH), 8)
+
+
 class CONSOLE_PORT(ConfigOption):
     """Set the tcp port to listen on for console connections"""
 
@@ -553,6 +694,10 @@ settings = {
     "INTERPRETERS": INTERPRETERS,
     "CLASS": CLASS,
     "NUMTHREADS": NUMTHREADS,
+    "RULETIMEOUT": RULETIMEOUT,
+    "CORRELATEWINDOW": CORRELATEWINDOW,
+    "MAXSTALE": MAXSTALE,
+    "PREFETCH": PREFETCH,
     "CONSOLE_PORT": CONSOLE_PORT,
     "EMAIL_FROM": EMAIL_FROM,
     "EMAIL_REPLYTO": EMAIL_REPLYTO,
@@ -0,0 +1,154 @@
+
+from __future__ import absolute_import
+
+__doc__ = """Root-cause correlation of directive failures.
+
+A directive with a correlate argument belongs to a correlation group
+inferred from what it checks:
+
+    correlate=host      - the host checked (its host argument, or this host)
+    correlate=subnet    - the /24 subnet of the host checked
+    correlate=group     - the config group the directive is defined in
+    correlate=<name>    - any other value names the correlation group itself
+
+The first directive of a correlation group to fail becomes the root of an
+incident and performs its actions as usual.  Directives of the same group
+which fail within CORRELATEWINDOW seconds of the root are recorded as part
+of the incident and their actions (and so their act2ok actions) are
+suppressed while the root is failed.  One incident summary is logged when
+the root recovers, and the root's actions can report the incident with
+the %(incident)s variable.
+"""
+
+import socket
+import threading
+import time
+
+from . import log
+
+
+# Failures starting within WINDOW seconds of an incident's root failure
+# are correlated with it.  Set with CORRELATEWINDOW in config.
+WINDOW = 300
+
+# An incident whose root has not been checked for this many of its
+# scanperiods is abandoned (eg: the root was removed by a config rescan).
+STALE_SCANPERIODS = 2
+
+
+def key(d, correlate):
+    """Return the correlation group key of directive d for its correlate
+    argument."""
+
+    correlate = correlate.strip()
+    host = getattr(d.args, 'host', None) or log.hostname
+    if correlate == 'host':
+        return 'host:%s' % (host.lower())
+    if correlate == 'subnet':
+        try:
+            addr = socket.gethostbyname(host)
+        except (socket.error, UnicodeError):
+            log.log("<correlate>key(): cannot resolve '%s' for %s, correlating by host"
+                    % (host, d.ID), 4)
+            return 'host:%s' % (host.lower())
+        return 'subnet:%s.0/24' % ('.'.join(addr.split('.')[:3]))
+    if correlate == 'group':
+        return 'group:%s' % (d.Config.name)
+    return correlate
+
+
+class Incident(object):
+    """Failures of a correlation group attributed to one root failure."""
+
+    __slots__ = ('key', 'root', 'start', 'members', 'suppressed')
+
+    def __init__(self, key, root, start):
+        self.key = key
+        self.root = root              # the directive which failed first
+        self.start = start            # time the root failure was detected
+        self.members = []             # correlated directives, in failure order
+        self.suppressed = 0           # number of action runs suppressed
+
+    def __str__(self):
+        return "%s: root %s, %d correlated failures (%s), %d action runs suppressed" % (
+            self.key, self.root.ID, len(self.members),
+            ', '.join([str(m.ID) for m in self.members]), self.suppressed)
+
+    def stale(self, now):
+        """Return True if the root is no longer failed or being checked."""
+
+        state = self.root.state
+        if state.status != 'fail':
+            return True
+        return now - state.lastfailtime > STALE_SCANPERIODS * self.root.scanperiod + WINDOW
+
+
+class Correlator(object):
+    """Open incidents, by correlation group key.  Shared by all directive
+    threads."""
+
+    def __init__(self):
+        self.incidents = {}
+        self.lock = threading.Lock()
+
+    def suppress(self, d, now=None):
+        """Called when directive d has failed and would perform its actions.
+        Return True if its actions should be suppressed as it is part of
+        an incident with another root."""
+
+        if d.correlatekey is None:
+            return False
+        if now is None:
+            now = time.time()
+        start = d.state.faildetecttime or now
+
+        with self.lock:
+            incident = self.incidents.get(d.correlatekey)
+            if incident is not None and incident.root is not d and incident.stale(now):
+                log.log("<correlate>Correlator.suppress(): incident %s closed, root not failed" % (incident), 5)
+                incident = None
+
+            if incident is None:
+                self.incidents[d.correlatekey] = Incident(d.correlatekey, d, start)
+                log.log("<correlate>Correlator.suppress(): incident %s opened, root %s"
+                        % (d.correlatekey, d.ID), 6)
+                return False
+            if incident.root is d:
+                return False
+
+            if d not in incident.members:
+                if abs(start - incident.start) > WINDOW:
+                    return False        # failure not related by time
+                incident.members.append(d)
+            incident.suppressed = incident.suppressed + 1
+
+        log.log("<correlate>Correlator.suppress(): %s actions suppressed, root %s"
+                % (d.ID, incident.root.ID), 7)
+        return True
+
+    def resolve(self, d):
+        """Called when directive d has recovered.  Closes the incident d
+        is the root of, logging the incident summary."""
+
+        if d.correlatekey is None:
+            return
+
+        with self.lock:
+            incident = self.incidents.get(d.correlatekey)
+            if incident is None or incident.root is not d:
+                return
+            del self.incidents[d.correlatekey]
+
+        if incident.members:
+            log.log("<correlate>Correlator.resolve(): incident %s" % (incident), 3)
+
+    def incident(self, d):
+        """Return the incident summary for d, if it is an incident root."""
+
+        incident = self.incidents.get(d.correlatekey)
+        if incident is None or incident.root is not d:
+            return ''
+        return str(incident)
+
+
+correlator = Correlator()
@@ -1,11 +1,21 @@
 
 from __future__ import absolute_import
 
+import math
 import time
 import threading
+from array import array
 
+from .. _compat import MappingProxyType, long
 from . import log
 
+# numpy is optional: history windows are computed with it if available,
+# otherwise in Python.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # Exceptions
 class IndexError(Exception):
@@ -26,6 +36,39 @@ class DataModuleError(Exception):
     pass
 
 
+# Stale-while-revalidate: if not 0, readers of data which expired less
+# than MAXSTALE seconds ago get it straight away while it is refreshed in
+# the background.  Set with MAXSTALE in config; a collector can set its
+# own maxstale.
+MAXSTALE = 0
+
+# Collectors refresh every REFRESH_FRACTION of the smallest scanperiod of
+# the directives using them (see DataCollect.align()), so each check of
+# those directives sees data collected since its previous check.
+REFRESH_FRACTION = 0.9
+
+# Prefetch: if True, collectors refresh in the background PREFETCH_LEAD
+# seconds before their data expires, so directives do not wait for data
+# collection.  Set with PREFETCH in config.
+PREFETCH = False
+PREFETCH_LEAD = 2
+
+# Fields costing at least EXPENSIVE_COST (see DataCollect.costs) are only
+# collected every sample_refreshes refreshes of a collector, which is
+# SAMPLE_REFRESHES by default; in between their last value is kept.
+EXPENSIVE_COST = 10
+SAMPLE_REFRESHES = 1
+
+# A counter decreasing between refreshes has wrapped if it was within the
+# range of a COUNTER_BITS counter and wrapping explains the change in less
+# than half that range; otherwise it was reset.
+COUNTER_BITS = (32, 64)
+
+# Upper bounds (in seconds) of the buckets of the refresh duration
+# histogram kept by CollectorStats; the last bucket is for longer ones.
+REFRESH_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30)
+
+
 # Data collection management classes
 class DataModules(object):
     """This class keeps track of which data collection modules are required
@@ -59,16 +102,26 @@ class DataModules(object):
         if osname:
             self.os_search_path.append(osname)
 
-        self.collectors = {}                # dictionary of collectors and their associated objects
+        self.collectors = {}                # (module, collector) -> CollectorRef
+        self.modules = {}                # module name -> module object, None if not found
+        self.lock = threading.Lock()        # lock before changing self.collectors or self.modules
+        self.aligned = False        # collectors are aligned once created, see start_schedulers()
 
     def import_module(self, module):
         """Return a reference to the imported module, or none if the
-        import failed.
+        import failed.  The search is only made once for each module.
         """
+
+        try:
+            return self.modules[module]
+        except KeyError:
+            pass
+
         modobj = None
 
-        # first look for platform specific data collect module
-        for ospath in self.os_search_path:
+        # first look for platform specific data collect module,
+        # then for generic module
+        for ospath in self.os_search_path + ['generic']:
             try:
                 modparent = __import__(
                     '.'.join(['boristool', 'arch', ospath]),
@@ -83,34 +136,36 @@ class DataModules(object):
             except ImportError:
                 pass
 
-        if modobj is None:
-            # No platform specific module, look for generic module
-            try:
-                modparent = __import__(
-                    '.'.join(['boristool', 'arch', 'generic']),
-                    globals(),
-                    locals(),
-                    [module],
-                )
-                modobj = getattr(modparent, module)
-            except AttributeError:
-                pass
-            except ImportError:
-                pass
-
+        self.modules[module] = modobj
         return modobj
 
-    def request(self, module, collector):
+    def request(self, module, collector, consumer=None):
         """Directives request data collection objects and the modules they should
-        be defined in.
+        be defined in.  consumer is the requesting directive, whose
+        scanperiod the collector refresh is aligned with (see
+        DataCollect.align()).
 
-        Return reference to collector object if successful;
-        Return None if failed.
+        Return a CollectorRef for the collector, which is only created
+        when it is first used.  Collectors are known by module and class
+        name, so classes of the same name in different modules are
+        different collectors.
+
+        Raise DataModuleError if the collector is not available.
         """
 
-        # if collector already initiated, return reference
-        if collector in list(self.collectors.keys()):
-            return self.collectors[collector]
+        key = (module, collector)
+        with self.lock:
+            ref = self.collectors.get(key)
+            if ref is None:
+                ref = self.collectors[key] = CollectorRef(self, module, collector, self._collectorClass(module, collector))
+        if consumer is not None:
+            ref.consumers.append(consumer)
+        return ref
+
+    def _collectorClass(self, module, collector):
+        """Return the class of collector from module, importing module if
+        necessary.  Called with self.lock held.
+        """
 
         log.log("<datacollect>DataModules.request(): importing module '%s' for collector '%s'" %
                 (module, collector), 8)
@@ -123,31 +178,193 @@ class DataModules(object):
             raise DataModuleError("Collector '%s', module '%s' not found or not available, os_search_path=%s" %
                                   (collector, module, self.os_search_path))
 
-        # initialise new collector instance
-        if hasattr(modobj, collector):
-            self.collectors[collector] = getattr(modobj, collector)()
-
-        else:
+        if not hasattr(modobj, collector):
             log.log("<datacollect>DataModules.request(): error, no such collector '%s' in module '%s'" %
                     (collector, module), 3)
             raise DataModuleError("No such collector '%s' in module '%s'" %
                                   (collector, module))
 
-        log.log("<datacollect>DataModules.request(): collector %s/%s initialised" %
-                (module, collector), 7)
+        return getattr(modobj, collector)
+
+    def statsDump(self):
+        """Return a list of lines showing the CollectorStats of each
+        collector created so far, slowest refreshes first."""
 
-        return self.collectors[collector]
+        refs = [r for r in list(self.collectors.values()) if r.collector is not None]
+        refs.sort(key=lambda r: -r.collector.stats.refresh_max)
+        return ["%s.%s: %s" % (r.module, r.name, r.collector.stats) for r in refs]
+
+    def start_schedulers(self, cfg, die_event):
+        """Align the refresh rate of each collector with the directives
+        using it, then start a thread refreshing it on schedule: a
+        publisher for collectors with directives subscribed in push mode
+        (see DataCollect.publisher()), otherwise a prefetcher if PREFETCH
+        is set (see DataCollect.prefetcher()).
+        """
+
+        self.aligned = True
+        for ((module, collector), ref) in list(self.collectors.items()):
+            if ref.collector is None and not PREFETCH:
+                continue                # aligned when created
+            c = ref.get()
+            name = '%s.%s' % (module, collector)
+            c.align()
+            c.alignFields()
+            if c.subscribers:
+                target = c.publisher
+                args = (cfg, die_event)
+                thrname = 'Publisher-%s' % (name)
+            elif PREFETCH:
+                target = c.prefetcher
+                args = (die_event,)
+                thrname = 'Prefetcher-%s' % (name)
+            else:
+                continue
+            thr = threading.Thread(group=None, target=target, name=thrname, args=args, kwargs={})
+            thr.setDaemon(1)        # die automatically when Main thread dies
+            thr.start()
+            log.log("<datacollect>DataModules.start_schedulers(): started %s, refresh rate %s secs, %d subscribers" %
+                    (thrname, c.refresh_rate, len(c.subscribers)), 7)
+
+
+class CollectorStats(object):
+    """Instrumentation of one collector: refresh durations and failures,
+    cache hits and the time readers waited for the data.
+
+    Counts are updated without locking by readers, so they may miss the
+    odd concurrent update; they are for finding slow collectors, not
+    accounting.
+    """
+
+    def __init__(self):
+        self.refreshes = 0                # collectData() calls
+        self.failures = 0                # DataFailures raised by collectData()
+        self.refresh_total = 0.0        # total time in collectData() (in seconds)
+        self.refresh_max = 0.0                # longest collectData() (in seconds)
+        self.histogram = [0] * (len(REFRESH_BUCKETS) + 1)        # collectData() calls by duration
+        self.hits = 0                        # reads of valid cached data
+        self.stale = 0                        # reads of stale data while refreshing, see MAXSTALE
+        self.misses = 0                        # reads which waited for a refresh
+        self.waits = 0                        # times data_semaphore or a refresh was waited for
+        self.wait_total = 0.0                # total time waited (in seconds)
+        self.wait_max = 0.0                # longest wait (in seconds)
+
+    def refreshed(self, duration, failed=False):
+        self.refreshes = self.refreshes + 1
+        if failed:
+            self.failures = self.failures + 1
+        self.refresh_total = self.refresh_total + duration
+        self.refresh_max = max(self.refresh_max, duration)
+        i = 0
+        while i < len(REFRESH_BUCKETS) and duration > REFRESH_BUCKETS[i]:
+            i = i + 1
+        self.histogram[i] = self.histogram[i] + 1
+
+    def waited(self, duration):
+        self.waits = self.waits + 1
+        self.wait_total = self.wait_total + duration
+        self.wait_max = max(self.wait_max, duration)
+
+    def hitRatio(self):
+        """Return the fraction of reads served from the cache (stale
+        reads included), 0.0 if there were none."""
+
+        reads = self.hits + self.stale + self.misses
+        if not reads:
+            return 0.0
+        return float(self.hits + self.stale) / reads
+
+    def __str__(self):
+        avg = 0.0
+        if self.refreshes:
+            avg = self.refresh_total / self.refreshes
+        buckets = ['<=%ss:%d' % (b, n) for (b, n) in zip(REFRESH_BUCKETS, self.histogram) if n]
+        if self.histogram[-1]:
+            buckets.append('>%ss:%d' % (REFRESH_BUCKETS[-1], self.histogram[-1]))
+        return "refreshes %d failures %d avg %.3fs max %.3fs [%s], cache hits %.1f%% (%d hits %d stale %d misses), waits %d total %.3fs max %.3fs" % (
+            self.refreshes, self.failures, avg, self.refresh_max, ' '.join(buckets),
+            self.hitRatio() * 100, self.hits, self.stale, self.misses,
+            self.waits, self.wait_total, self.wait_max)
+
+
+class CollectorRef(object):
+    """Reference to a collector returned by DataModules.request(): the
+    collector object is created when it is first used, ie: when any of
+    its attributes is accessed.  The directives using the collector are
+    kept in consumers until then.
+    """
+
+    __slots__ = ('modules', 'module', 'name', 'cls', 'consumers', 'collector', 'lock')
+
+    def __init__(self, modules, module, name, cls):
+        self.modules = modules        # the DataModules the collector was requested from
+        self.module = module
+        self.name = name
+        self.cls = cls                # collector class
+        self.consumers = []        # directives using the collector
+        self.collector = None        # collector object, once created
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Return the collector object, creating it if necessary."""
+
+        c = self.collector
+        if c is not None:
+            return c
+        with self.lock:
+            if self.collector is None:
+                c = self.cls()
+                c.consumers = self.consumers
+                if self.modules.aligned:
+                    c.align()
+                    c.alignFields()
+                self.collector = c
+                log.log("<datacollect>CollectorRef.get(): collector %s/%s initialised" %
+                        (self.module, self.name), 7)
+        return self.collector
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, key):
+        return self.get()[key]
 
 
 class Data(object):
     """An empty class to hold any data to be stored.
-    Do not access this data without first acquiring DataCollect.data_semaphore
-    for thread-safety.
+    This is where a collector stores the data it collects; it is only
+    accessed while holding DataCollect.data_semaphore.  Readers use the
+    Snapshot published from it instead.
     """
 
     pass
 
 
+class Snapshot(object):
+    """Read-only copy of the Data stored by one refresh of a collector.
+
+    Dictionaries become read-only mappings and lists become tuples.  A
+    collector publishes a new Snapshot after each refresh by replacing
+    its reference to the previous one, so readers need no lock: a Snapshot
+    never changes once it is published.
+    """
+
+    def __init__(self, data, when):
+        for (name, value) in vars(data).items():
+            if isinstance(value, dict):
+                value = MappingProxyType(dict(value))
+            elif isinstance(value, list):
+                value = tuple(value)
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, 'time', when)        # time of the refresh
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("Snapshot is read-only")
+
+
 class DataHistory(object):
     """Store previous data, with up to max_level levels of history.
     Set max_level with setHistory() or else no data is kept.
@@ -206,101 +423,368 @@ class DataHistory(object):
         return len(self.historical_data) - 1
 
 
+class Series(object):
+    """The last size values of one numeric field, in a ring buffer of
+    doubles (8 bytes per value).
+    """
+
+    __slots__ = ('size', 'count', 'buffer')
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0                          # number of values ever pushed
+        self.buffer = array('d', [0.0]) * size
+
+    def push(self, value):
+        self.buffer[self.count % self.size] = value
+        self.count = self.count + 1
+
+    def length(self):
+        return min(self.count, self.size)
+
+    def resize(self, size):
+        """Change the capacity, keeping the newest values."""
+
+        values = self.values()
+        self.size = size
+        self.count = 0
+        self.buffer = array('d', [0.0]) * size
+        for v in values[-size:]:
+            self.push(v)
+
+    def values(self, n=None):
+        """Return the last n values (all if None), oldest first, as a
+        numpy array if numpy is available, otherwise as a list.
+        """
+
+        length = self.length()
+        if n is None or n > length:
+            n = length
+        end = self.count % self.size
+        start = (self.count - n) % self.size
+        buf = self.buffer
+        if numpy is not None:
+            buf = numpy.frombuffer(buf, dtype=numpy.float64)
+            if n == 0:
+                return buf[:0]
+            if start < end:
+                return buf[start:end]
+            return numpy.concatenate((buf[start:], buf[:end]))
+        if n == 0:
+            return []
+        if start < end:
+            return buf[start:end].tolist()
+        return buf[start:].tolist() + buf[:end].tolist()
+
+    def __getitem__(self, age):
+        """The value from age samples ago (0 is the newest)."""
+
+        if age < 0 or age >= self.length():
+            raise IndexError("Series index out-of-range: index=%d" % (age))
+        return self.buffer[(self.count - 1 - age) % self.size]
+
+
+class ColumnarHistory(object):
+    """Store previous numeric data, with up to max_level levels of history
+    (plus the current data), column-wise: each number in a Snapshot gets a
+    Series, eg: for the datahash of the system collector,
+
+        history.mean('loadavg1', 5)        - average of the last 5 samples
+
+    Fields are named by their key in datahash, with '<key>.<field>' for
+    the numbers of datahash values with a getHash() method (eg: the df
+    objects of dfList), and by attribute name for numeric attributes of
+    the Snapshot (eg: numdisks).  Other data is not kept.
+
+    Window queries take the last n samples (all kept if n is None):
+     mean(), min(), max(), percentile() and slope(), the least-squares
+     change per second.
+    """
+
+    def __init__(self):
+        self.max_level = 0                # how many levels of data to keep
+        self.series = {}                # field name -> Series
+        self.times = None                # Series of the time of each sample
+
+    def setHistory(self, level):
+        """Set how many levels of historical data to keep track of.
+        By default no historical data will be kept.
+
+        The history level is only changed if the level is greater than
+        the current setting.  The history level is always set to the highest
+        required by all directives.
+        """
+
+        if level > self.max_level:
+            self.max_level = level
+            for series in self.series.values():
+                series.resize(level + 1)
+            if self.times is not None:
+                self.times.resize(level + 1)
+
+    def update(self, snapshot):
+        """Add the numbers of snapshot to the history.
+
+        If max_level is 0, no history is required, so nothing is done.
+        """
+
+        if self.max_level < 1:
+            return
+
+        size = self.max_level + 1
+        if self.times is None:
+            self.times = Series(size)
+        self.times.push(snapshot.time)
+
+        for (name, value) in numericFields(snapshot):
+            try:
+                series = self.series[name]
+            except KeyError:
+                series = self.series[name] = Series(size)
+            series.push(value)
+
+    def length(self):
+        """Returns how many samples of history are stored, not counting
+        the current sample.
+        """
+
+        if self.times is None:
+            return 0
+        return self.times.length() - 1
+
+    def __getitem__(self, num):
+        """Return a dictionary of the fields from num 'collection periods'
+        ago; num can be 0 which is the current data.
+        """
+
+        if num < 0 or num > self.length():
+            raise IndexError("DataHistory index out-of-range: index=%d" % (num))
+        count = self.times.count - num
+        return dict([(name, series[series.count - count]) for (name, series) in self.series.items()
+                     if 0 <= series.count - count < series.length()])
+
+    def values(self, name, n=None):
+        """Return the last n values of field name, oldest first."""
+
+        return self.series[name].values(n)
+
+    def mean(self, name, n=None):
+        values = self.values(name, n)
+        if numpy is not None:
+            return float(numpy.mean(values))
+        return math.fsum(values) / len(values)
+
+    def min(self, name, n=None):
+        return min(self.values(name, n))
+
+    def max(self, name, n=None):
+        return max(self.values(name, n))
+
+    def percentile(self, name, pct, n=None):
+        """Nearest-rank percentile of the last n values of field name."""
+
+        values = sorted(self.values(name, n))
+        rank = int(math.ceil(pct / 100.0 * len(values)))
+        return values[max(rank, 1) - 1]
+
+    def slope(self, name, n=None):
+        """Least-squares change of field name per second over the last n
+        samples; 0.0 if there are fewer than 2 samples.
+        """
+
+        series = self.series[name]
+        values = series.values(n)
+        if len(values) < 2:
+            return 0.0
+        times = self.times.values(self.times.length())[-len(values):]
+        if numpy is not None:
+            t = times - times.mean()
+            denom = float(numpy.dot(t, t))
+            if denom == 0:
+                return 0.0
+            return float(numpy.dot(t, values - values.mean())) / denom
+        tmean = math.fsum(times) / len(times)
+        vmean = math.fsum(values) / len(values)
+        denom = math.fsum([(t - tmean) ** 2 for t in times])
+        if denom == 0:
+            return 0.0
+        return math.fsum([(t - tmean) * (v - vmean) for (t, v) in zip(times, values)]) / denom
+
+
+NUMBER = (int, long, float)
+
+
+def _number(value):
+    return isinstance(value, NUMBER) and not isinstance(value, bool)
+
+
+def numericFields(snapshot):
+    """Return a list of (name, value) for the numbers in snapshot kept by
+    ColumnarHistory."""
+
+    result = []
+    for (attr, value) in vars(snapshot).items():
+        if attr == 'time':
+            continue
+        if _number(value):
+            result.append((attr, value))
+    datahash = getattr(snapshot, 'datahash', None)
+    if datahash is not None:
+        for (key, value) in datahash.items():
+            if _number(value):
+                result.append((key, value))
+            elif hasattr(value, 'getHash'):
+                for (field, v) in value.getHash().items():
+                    if _number(v):
+                        result.append(('%s.%s' % (key, field), v))
+    return result
+
+
+def _counterDelta(previous, value):
+    """Return the change of a counter from previous to value, allowing for
+    it wrapping (see COUNTER_BITS) or being reset to 0."""
+
+    delta = value - previous
+    if delta >= 0:
+        return delta
+    for bits in COUNTER_BITS:
+        limit = 2 ** bits
+        if previous < limit:
+            wrapped = limit - previous + value
+            if wrapped < limit // 2:
+                return wrapped
+            break
+    return value        # reset, counting from 0
+
+
 class DataCollect(object):
     """Provides a data collection and store class with automatic
     caching and refreshing of data in the cache.  Public functions
     are fully thread-safe as they can be called from many directive
     threads simultaneously.
 
+    Each refresh publishes the collected data as an immutable Snapshot
+    (self.snapshot).  Reading cached data takes no lock and makes no copy:
+    getHash() returns a read-only mapping of the snapshot.  Only refreshes
+    are serialised, by data_semaphore.
+
+    Refreshes of expired data are single-flight: one reader refreshes and
+    any other readers wait for that refresh rather than refreshing again.
+    With maxstale (or MAXSTALE) set, readers get data which expired less
+    than maxstale seconds ago straight away and a single background
+    refresh is started instead.
+
     Data is cached for 55 seconds by default.  Assign self.refresh_rate
-    to change this.  A collectData() function must be supplied by any
-    child class of DataCollect.  This function should get data by
-    whatever means and assign it to variables in self.data.
+    to change this; align() sets it from the scanperiods of the directives
+    using the collector, once the config is read.  A collectData()
+    function must be supplied by any child class of DataCollect.  This
+    function should get data by whatever means and assign it to variables
+    in self.data.
 
     Historical data will be automatically kept by calling setHistory(n)
     with n>0.  n levels of historical data will then be automatically
     kept.  If setHistory() is called multiple times, the highest n will
-    stay in effect.
+    stay in effect.  History is kept column-wise for the numeric data
+    only, see ColumnarHistory.
+
+    Directives re-checking a failure (numchecks > 1) call recheck()
+    rather than forcing a refresh().  Re-check refreshes are collapsed:
+    data refreshed within the last recheck_rate seconds is used as is.
+    A collector able to refresh the data of a single key (eg: one
+    filesystem) defines collectKey(key), which updates self.data for key
+    only and returns True, or returns False if it cannot.
+
+    Directives in push mode subscribe() to the collector.  The collector
+    then refreshes on its own in a publisher() thread, every smallest
+    scanperiod of its subscribers, and triggers the subscribers to check
+    the new data straight away.
 
     Public functions are:
-     getHash()        - return a copy of a data dictionary
-     getList()        - return a copy of a data list
+     getHash()        - return a data dictionary (read-only)
+     getList()        - return a data list (as a tuple)
      hashKeys()        - return list of data dictionary keys
      __getitem__() - use DataCollect object like a dictionary to fetch data
      refresh()        - force a cache refresh
+     recheck(key)  - refresh for a directive re-check, see below
      setHistory(n) - set max level (n) of data history to automatically keep
+     subscribe(d)  - trigger directive d each time data is published
+
+    Collectors with fields which are expensive to collect can skip those
+    nobody uses: costs maps each field to its relative cost (1 is cheap),
+    and collectData() only collects the fields for which needs() is True.
+    alignFields() sets the fields needed from the rules of the directives
+    using the collector; until then all fields are collected.
+
+    Fields named in counters are monotonic counters: each refresh also
+    publishes <field>_delta, the change since the previous refresh, and
+    <field>_rate, the change per second (both 0 on the first refresh).
+    Counters are looked for in datahash, or in the dicts returned by
+    counterRows() if the collector overrides it.
     """
 
+    costs = {}        # relative cost of collecting each field, by field name
+    counters = ()        # names of the fields which are monotonic counters
+
     def __init__(self):
         self.refresh_rate = 55        # amount of time current information will be
                                       # cached before being refreshed (in seconds)
         self.refresh_time = 0        # information must be refreshed at first request
+        self.recheck_rate = 5        # minimum time between re-check refreshes (in seconds)
+        self.last_refresh = 0        # time of the last full refresh
+        self.key_refresh = {}        # time of the last refresh of single keys, by key
+        self.maxstale = None        # stale-while-revalidate bound (in seconds), MAXSTALE if None
+        self.flight = None        # threading.Event set when the refresh in progress is done
+        self.flight_lock = threading.Lock()        # lock before accessing self.flight
 
         self.history_level = 0        # how many levels of historical data to keep
-        self.history = DataHistory()        # historical data
-        self.data_semaphore = threading.Semaphore()    # lock before accessing self.data/refresh_time
+        self.history = ColumnarHistory()        # historical data
+        self.data_semaphore = threading.Semaphore()    # lock before accessing self.data or refreshing
+        self.data = Data()                # data being collected
+        self.snapshot = Snapshot(self.data, 0)        # data published by the last refresh
+        self.subscribers = []        # directives triggered when new data is published
+        self.consumers = []        # directives using this collector
+        self.fields = None        # fields used by the consumers, None for all
+        self.sample_refreshes = SAMPLE_REFRESHES        # refreshes between collecting expensive fields
+        self.refreshes = 0        # number of refreshes made
+        self.sampled = {}        # refresh an expensive field was last collected in, by field
+        self.counter_values = {}        # (row key, counter) -> (time, value) of the last refresh
+        self.stats = CollectorStats()        # timings and counts, see statsDump()
 
     # Public, thread-safe, methods
     def getHash(self, hash='datahash'):
-        """Return a copy of the specified data hash, datahash by default.
-        Specify an alternate variable name to fetch it instead.
-
-        TODO: it might be better to use the 'copy' module to make sure
-         a full deep copy is made of the date...
+        """Return the specified data hash, datahash by default, as a
+        read-only mapping.  Specify an alternate variable name to fetch it
+        instead.
         """
 
         self._checkCache()              # refresh data if necessary
-        dh = {}
-        self.data_semaphore.acquire()        # thread-safe access to self.data
-        exec('dh.update(self.data.%s)' % (hash))        # copy data hash
-        self.data_semaphore.release()
-
-        return(dh)
+        return getattr(self.snapshot, hash)
 
     def hashKeys(self):
         """Return the list of datahash keys.
         """
 
         self._checkCache()              # refresh data if necessary
-        self.data_semaphore.acquire()        # thread-safe access to self.data
-        k = list(self.data.datahash.keys())
-        self.data_semaphore.release()
-
-        return(k)
+        return list(self.snapshot.datahash.keys())
 
     def getList(self, listname):
-        """Return a copy of the specified data list.
+        """Return the specified data list, as a tuple.
         The function is thread-safe and supports the built-in data caching.
-
-        TODO: it might be better to use the 'copy' module to make sure
-         a full deep copy is made of the date...
         """
 
         self._checkCache()              # refresh data if necessary
-        self.data_semaphore.acquire()        # thread-safe access to self.data
-        exec('list_copy = self.data.%s[:]' % (listname))  # copy data list
-        self.data_semaphore.release()
-
-        return(list_copy)
+        return getattr(self.snapshot, listname)
 
     def __getitem__(self, key):
         """Overload '[]', eg: returns corresponding data object for given key.
-
-        TODO: it might be better to use the 'copy' module to make sure
-         a full deep copy is made of the date...
         """
 
         self._checkCache()              # refresh data if necessary
 
-        self.data_semaphore.acquire()        # thread-safe access to self.data
         try:
-            r = self.data.datahash[key]
+            return self.snapshot.datahash[key]
         except KeyError:
-            self.data_semaphore.release()
             raise KeyError("Key %s not found in data hash" % (key))
-        self.data_semaphore.release()
-
-        return r
 
     def refresh(self):
         """Refresh data.
@@ -308,11 +792,39 @@ class DataCollect(object):
         This function can be called publically to force a refresh.
         """
 
-        self.data_semaphore.acquire()        # thread-safe access to self.data
+        self._lock()        # thread-safe access to self.data
         log.log("<datacollect>DataCollect.refresh(): forcing data refresh", 7)
         self._refresh()
         self.data_semaphore.release()
 
+    def recheck(self, key=None):
+        """Refresh data for a directive re-check of key (or of all the
+        data if key is None), unless it was refreshed less than
+        recheck_rate seconds ago.  Only key is refreshed if the collector
+        supports it (see collectKey()).
+        """
+
+        self._lock()        # thread-safe access to self.data
+        try:
+            now = time.time()
+            last = max(self.last_refresh, self.key_refresh.get(key, 0))
+            if now - last < self.recheck_rate:
+                log.log("<datacollect>DataCollect.recheck(): data for %s refreshed %.1f secs ago, not refreshed"
+                        % (key, now - last), 7)
+                return
+
+            collectKey = getattr(self, 'collectKey', None)
+            if key is not None and collectKey is not None and self.last_refresh:
+                if collectKey(key):
+                    self.key_refresh[key] = now
+                    self._publish()
+                    return
+
+            log.log("<datacollect>DataCollect.recheck(): forcing data refresh", 7)
+            self._refresh()
+        finally:
+            self.data_semaphore.release()
+
     def setHistory(self, level):
         """Set how many levels of historical data to keep track of.
         By default no historical data will be kept.
@@ -324,18 +836,210 @@ class DataCollect(object):
 
         self.history.setHistory(level)
 
+    def subscribe(self, directive):
+        """Trigger directive (see Directive.trigger()) each time new data
+        is published by publisher().
+        """
+
+        if directive not in self.subscribers:
+            self.subscribers.append(directive)
+
+    def align(self):
+        """Set refresh_rate from the smallest scanperiod of the directives
+        using this collector (templates excepted), if any.
+        """
+
+        periods = [d.scanperiod for d in self.consumers
+                   if d.args.template != 'self' and getattr(d, 'scanperiod', None)]
+        if periods:
+            self.refresh_rate = max(1, int(min(periods) * REFRESH_FRACTION))
+
+    def alignFields(self):
+        """Set the fields to collect to those used by the directives using
+        this collector (templates excepted), or all fields if any of them
+        does not declare the fields it uses (see Directive.fields()).
+        """
+
+        fields = set()
+        for d in self.consumers:
+            if d.args.template == 'self':
+                continue
+            used = d.fields()
+            if used is None:
+                fields = None
+                break
+            fields.update(used)
+        if fields is not None:
+            for f in self.counters:
+                if f + '_rate' in fields or f + '_delta' in fields:
+                    fields.add(f)
+        if fields is not None and not self.consumers:
+            fields = None
+        self.fields = fields
+        if fields is not None:
+            log.log("<datacollect>DataCollect.alignFields(): %s collecting %d of %d costed fields" %
+                    (self.__class__.__name__, len(fields.intersection(self.costs)), len(self.costs)), 7)
+
+    def needs(self, datahash, *fields):
+        """Return True if any of fields must be collected in this refresh:
+        they are used by a consumer and, if they are expensive (see
+        EXPENSIVE_COST), they are due to be sampled.  Used fields which are
+        not due are copied into datahash from the last published data.
+
+        Only to be called by collectData().
+        """
+
+        used = [f for f in fields if self.fields is None or f in self.fields]
+        if not used:
+            return False
+        if self.sample_refreshes <= 1 or max([self.costs.get(f, 1) for f in used]) < EXPENSIVE_COST:
+            return True
+
+        last = min([self.sampled.get(f, -self.sample_refreshes) for f in used])
+        previous = getattr(self.snapshot, 'datahash', {})
+        if self.refreshes - last < self.sample_refreshes and all([f in previous for f in used]):
+            for f in used:
+                datahash[f] = previous[f]
+            return False
+        for f in used:
+            self.sampled[f] = self.refreshes
+        return True
+
+    def counterRows(self):
+        """Return a list of (key, dict) of the dicts of collected data
+        holding counters: datahash (key None) by default.  Collectors
+        keeping counters in the values of datahash override this.
+
+        Only to be called by _fetchData().
+        """
+
+        datahash = getattr(self.data, 'datahash', None)
+        if datahash is None:
+            return []
+        return [(None, datahash)]
+
+    def publish_period(self):
+        """Seconds between refreshes in publisher(): the smallest scanperiod
+        of the subscribed directives."""
+
+        return min([d.scanperiod for d in self.subscribers])
+
+    def publisher(self, cfg, die_event):
+        """Publisher thread: refresh the data every publish_period() seconds
+        and trigger the subscribed directives, until die_event is set.
+        """
+
+        while not die_event.isSet():
+            self.refresh()
+            for d in self.subscribers:
+                d.trigger(cfg)
+            log.log("<datacollect>DataCollect.publisher(): published to %d subscribers" %
+                    (len(self.subscribers)), 8)
+            die_event.wait(self.publish_period())
+
+    def prefetcher(self, die_event):
+        """Prefetcher thread: refresh the data PREFETCH_LEAD seconds (at
+        most half the refresh_rate) before it expires, until die_event is
+        set.  Readers arriving during the refresh wait for it.
+        """
+
+        lead = min(PREFETCH_LEAD, self.refresh_rate / 2.0)
+        while not die_event.isSet():
+            now = time.time()
+            wait = self.refresh_time - lead - now
+            if wait > 0:
+                die_event.wait(wait)
+                continue
+            (flight, leader) = self._startFlight(now + lead)
+            if leader:
+                self._flightRefresh(flight)
+                log.log("<datacollect>DataCollect.prefetcher(): prefetched data", 8)
+            elif flight is not None:
+                flight.wait()
+
     # Private methods.  Thread safety not guaranteed if not using public methods.
     def _checkCache(self):
         """Check if cached data is invalid, ie: refresh_time has been exceeded.
+        Valid cached data is checked without locking.
         """
 
-        self.data_semaphore.acquire()                # thread-safe access to self.refresh_time and self._refresh()
-        if time.time() > self.refresh_time:
+        now = time.time()
+        if now <= self.refresh_time:
+            self.stats.hits = self.stats.hits + 1
+            return
+
+        maxstale = self.maxstale
+        if maxstale is None:
+            maxstale = MAXSTALE
+        background = maxstale and self.last_refresh and now <= self.refresh_time + maxstale
+
+        (flight, leader) = self._startFlight(now)
+        if flight is None:
+            self.stats.hits = self.stats.hits + 1
+            return                # refreshed meanwhile
+
+        if background:
+            self.stats.stale = self.stats.stale + 1
+            if leader:
+                log.log("<datacollect>DataCollect._checkCache(): using stale data, refreshing in background", 7)
+                thr = threading.Thread(group=None, target=self._flightRefresh, name='Refresh-%s' % (self.__class__.__name__),
+                                       args=(flight,), kwargs={})
+                thr.setDaemon(1)        # die automatically when Main thread dies
+                thr.start()
+        elif leader:
+            self.stats.misses = self.stats.misses + 1
             log.log("<datacollect>DataCollect._checkCache(): refreshing data", 7)
-            self._refresh()
+            self._flightRefresh(flight)
         else:
-            log.log("<datacollect>DataCollect._checkCache(): using cached data", 7)
-        self.data_semaphore.release()
+            self.stats.misses = self.stats.misses + 1
+            log.log("<datacollect>DataCollect._checkCache(): waiting for refresh in progress", 7)
+            start = time.time()
+            flight.wait()
+            self.stats.waited(time.time() - start)
+
+    def _lock(self):
+        """Acquire data_semaphore, recording the time waited for it."""
+
+        if self.data_semaphore.acquire(False):
+            return
+        start = time.time()
+        self.data_semaphore.acquire()
+        self.stats.waited(time.time() - start)
+
+    def _startFlight(self, due):
+        """Join the refresh in progress, or start one if the data expires
+        before time due.  Return (flight, leader): flight is the Event set
+        when the refresh is done, or None if no refresh is needed; leader is
+        True if the caller started the refresh and must make it (see
+        _flightRefresh()).
+        """
+
+        self.flight_lock.acquire()
+        try:
+            if self.flight is not None:
+                return (self.flight, False)
+            if self.refresh_time > due:
+                return (None, False)        # refreshed meanwhile
+            self.flight = threading.Event()
+            return (self.flight, True)
+        finally:
+            self.flight_lock.release()
+
+    def _flightRefresh(self, flight):
+        """Refresh data for all readers waiting on flight, the Event of the
+        refresh in progress."""
+
+        try:
+            self._lock()
+            try:
+                self._refresh()
+            finally:
+                self.data_semaphore.release()
+        finally:
+            self.flight_lock.acquire()
+            self.flight = None
+            self.flight_lock.release()
+            flight.set()
 
     def _refresh(self):
         """Refresh data by calling _fetchData() and increasing refresh_time.
@@ -347,7 +1051,9 @@ class DataCollect(object):
         self._fetchData()
 
         # new refresh time is current time + refresh rate (seconds)
-        self.refresh_time = time.time() + self.refresh_rate
+        self.last_refresh = time.time()
+        self.refresh_time = self.last_refresh + self.refresh_rate
+        self.key_refresh = {}
 
     def _fetchData(self):
         """Initialise a new data collection by first resetting the current data,
@@ -361,13 +1067,51 @@ class DataCollect(object):
         """
 
         self.data = Data()                # new, empty data-store
+        self.refreshes = self.refreshes + 1
 
+        start = time.time()
         try:
             self.collectData()          # user-supplied function to collect some data
                                         # and store in self.data
         except DataFailure as err:
+            self.stats.refreshed(time.time() - start, failed=True)
             log.log("<datacollect>DataCollect._fetchData(): DataFailure, %s" %
                     (err), 5)
+            self._publish()
             # TODO: need to tell the Directive that things have gone wrong?
         else:
-            self.history.update(self.data)        # add collected data to history
+            self.stats.refreshed(time.time() - start)
+            if self.counters:
+                self._countRates(time.time())
+            self._publish()
+            self.history.update(self.snapshot)        # add collected data to history
+
+    def _countRates(self, now):
+        """Add <counter>_delta and <counter>_rate to the collected data
+        for each counter, from its value in the previous refresh.  Only
+        the counter values are kept between refreshes.
+        """
+
+        last = self.counter_values
+        values = {}
+        for (key, row) in self.counterRows():
+            for f in self.counters:
+                value = row.get(f)
+                if not isinstance(value, (int, long, float)):
+                    continue
+                values[(key, f)] = (now, value)
+                delta = 0
+                rate = 0.0
+                previous = last.get((key, f))
+                if previous is not None:
+                    delta = _counterDelta(previous[1], value)
+                    if now > previous[0]:
+                        rate = delta / float(now - previous[0])
+                row[f + '_delta'] = delta
+                row[f + '_rate'] = rate
+        self.counter_values = values
+
+    def _publish(self):
+        """Publish self.data to readers as a new Snapshot."""
+
+        self.snapshot = Snapshot(self.data, time.time())
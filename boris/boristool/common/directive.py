@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
-import string
-import re
+import copy
 import sys
 import time
 import traceback
 
+from .. _compat import intern
 from . import action
+from . import actionplan
+from . import correlate
 from . import utils
 from . import log
 from . import ack
 from . import history
 from . import datacollect
+from . import table
 
 
 #
@@ -35,12 +38,69 @@ class TemplateDirective(Exception):
     """
 
 
+class RuleTimeout(Exception):
+    """RuleTimeout: a directive rule took longer than its ruletimeout to
+    evaluate and was aborted.
+    """
+
+
+# Default maximum time (in seconds) a directive rule may take to evaluate.
+# Set with RULETIMEOUT in config; can be overridden per directive with the
+# ruletimeout argument.  0 means no limit.
+RULETIMEOUT = 0
+
+# Directives whose rule keeps timing out are re-queued at scanperiod times
+# 2**(consecutive timeouts), up to this many times scanperiod.
+RULETIMEOUT_MAXBACKOFF = 16
+
+# How many trace events to let through between checks of the clock.
+RULETIMEOUT_CHECKSTEPS = 100
+
+# Number of recent checks in which status changes are counted for flap
+# detection, see the flapthreshold argument.
+FLAPWINDOW = 20
+FLAPMASK = (1 << FLAPWINDOW) - 1
+
+
+def evalRule(rule, context, timeout):
+    """Evaluate rule with context as the locals, raising RuleTimeout if
+    evaluation takes longer than timeout seconds.
+
+    The limit is enforced with a trace function installed only for the
+    duration of the evaluation, so it is only checked while Python code is
+    running; a single long-running builtin call cannot be interrupted.
+    """
+
+    if not timeout:
+        return eval(rule, {}, context)
+
+    deadline = time.time() + timeout
+    steps = [0]
+
+    def tracer(frame, event, arg):
+        steps[0] = steps[0] + 1
+        if steps[0] % RULETIMEOUT_CHECKSTEPS == 0 and time.time() > deadline:
+            raise RuleTimeout("rule took longer than %s seconds" % (timeout))
+        return tracer
+
+    oldtrace = sys.gettrace()
+    sys.settrace(tracer)
+    try:
+        return eval(rule, {}, context)
+    finally:
+        sys.settrace(oldtrace)
+
+
 # Directive management objects
 class State(object):
     """
     Object to track the state of a directive.
+    Times are stored as epoch seconds (floats).
     """
 
+    __slots__ = ('ID', 'lastfailtime', 'faildetecttime', 'ack', 'checkcount',
+                 'failcount', 'thisdirective', 'status', 'transitions', 'flapping')
+
     def __init__(self, thisdirective):
         self.ID = None                        # each directive has a unique ID
         self.lastfailtime = None        # last time a failure was detected
@@ -59,15 +119,43 @@ class State(object):
         # Initial value cannot be 'ok' because of 'checkdependson' race-condition.
         self.status = 'unknown'   # Status of most recent check.
 
-    def ack(self, user=None, details=None):
+        # Bit i of transitions is set if the check i checks ago changed
+        # the status between ok and failed.
+        self.transitions = 0
+        self.flapping = False        # too many status changes, actions suppressed
+
+    def acknowledge(self, user=None, details=None):
         """Record a user acknowledgement for current problem."""
 
         self.ack.set(user, details)                # set the acknowledgement
 
+    def transition(self, changed):
+        """Record whether the current check changed the status, and start
+        or stop flapping as the number of changes in the last FLAPWINDOW
+        checks crosses the directive's flapthreshold.  Flapping stops once
+        the changes drop to half the threshold."""
+
+        self.transitions = ((self.transitions << 1) | changed) & FLAPMASK
+        threshold = self.thisdirective.flapthreshold
+        if not threshold:
+            return
+
+        changes = bin(self.transitions).count('1')
+        if not self.flapping and changes >= threshold:
+            self.flapping = True
+            log.log("<directive>State.transition(): ID '%s' flapping, %d status changes in %d checks - actions suppressed"
+                    % (self.ID, changes, FLAPWINDOW), 4)
+            self.thisdirective.flapAction(changes)
+        elif self.flapping and changes <= threshold // 2:
+            self.flapping = False
+            log.log("<directive>State.transition(): ID '%s' no longer flapping, %d status changes in %d checks"
+                    % (self.ID, changes, FLAPWINDOW), 4)
+
     def statefail(self):
         """Update state info for check failure."""
 
-        timenow = time.localtime(time.time())
+        timenow = time.time()
+        self.transition(self.status == "ok")
 
         # is this a transition from "ok" to "fail" ?
         # Include "unknown" to get the faildetecttime, etc., behavior
@@ -100,6 +188,8 @@ class State(object):
         """Update state info for check succeeding.
         Perform actions depending on previous state."""
 
+        self.transition(self.status == "fail")
+
         # is this a transition from "fail" to "ok" ?
         if self.status == "fail":
             # This is a state change from "fail" to "ok".
@@ -110,17 +200,18 @@ class State(object):
 
             # Mark the lastfailtime as now, as state has been failed up until
             # this point in time.
-            timenow = time.localtime(time.time())
-            self.lastfailtime = timenow
+            self.lastfailtime = time.time()
 
             log.log("<directive>State.stateok(): State changed to OK.  ID '%s'."
                     % (self.ID), 7)
 
-            if 'act2okList' in dir(self.thisdirective.args):
+            if hasattr(self.thisdirective.args, 'act2okList'):
                 # chris 2003-10-03: only perform act2ok action if any actions were called.
                 #        In cases where check fails but actiondependson causes actions to
                 #        be skipped, we don't need the act2ok actions to be called.
-                if self.thisdirective.performedactions:
+                if self.flapping:
+                    log.log("<directive>State.stateok(): act2ok actions skipped while flapping.", 8)
+                elif self.thisdirective.performedactions:
                     self.thisdirective.performAction(Config, self.thisdirective.args.act2okList)
                 else:
                     log.log("<directive>State.stateok(): act2ok actions skipped as no actions were called.", 8)
@@ -130,7 +221,7 @@ class State(object):
         else:
             # If state wasn't previously failed then it is still ok.
             # This is when the 'actelse' actions should be performed.
-            if 'actelseList' in dir(self.thisdirective.args):
+            if hasattr(self.thisdirective.args, 'actelseList'):
                 self.thisdirective.performAction(Config, self.thisdirective.args.actelseList)
 
         self.status = "ok"
@@ -148,10 +239,7 @@ class State(object):
         """Length of time since problem first found and problem last detected.
            (ie: faildetecttime and lastfailtime).  Returned as time 9-tuple."""
 
-        t1 = time.mktime(self.faildetecttime)
-        t2 = time.mktime(self.lastfailtime)
-
-        td = t2 - t1
+        td = self.lastfailtime - self.faildetecttime
 
         t0 = time.gmtime(0)                        # time base (ie: 1/1/1970)
         t9 = time.gmtime(td)                        # time diff from time base as 9-tuple
@@ -164,18 +252,67 @@ class State(object):
 
 
 class Args(object):
-    """Container for holding directive arguments."""
+    """Container for holding directive arguments.
 
-    def __init__(self):
-        """Nothing to do really."""
-        pass
+    Arguments are accessed as attributes, eg: args.rule, but are stored
+    in a single dictionary as their names are only known when the config
+    is parsed.
+
+    If parent is given (the Args of a template directive) any argument
+    not set locally is looked up in parent, so directives using a
+    template share the template arguments and only store overrides.
+    """
+
+    __slots__ = ('_values', '_parent')
+
+    def __init__(self, parent=None):
+        object.__setattr__(self, '_values', {})
+        object.__setattr__(self, '_parent', parent)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            if self._parent is None or name.startswith('__'):
+                raise AttributeError(name)
+            return getattr(self._parent, name)
+
+    def __setattr__(self, name, value):
+        self._values[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __dir__(self):
+        if self._parent is None:
+            return sorted(self._values)
+        return sorted(set(self._values).union(dir(self._parent)))
 
 
 class Directive(object):
     """
     The base directive class.  All directives are derived from this base class.
+
+    Directives use __slots__ to keep large configs compact; sub-classes
+    should declare __slots__ for any extra attributes they set.
     """
 
+    __slots__ = ('_ID', 'type', 'need_collectors', 'data_collectors',
+                 'Action', 'defaultVarDict', 'console_output',
+                 'actiondependson', 'checkdependson', 'state', 'requeueTime',
+                 'args', 'scanperiod', 'actionperiod', 'current_actionperiod',
+                 'lastactiontime', 'last_check_time', 'history_size', 'history',
+                 'excludehosts', 'actionmaxcalls', 'performedactions',
+                 'ruletimeouts', 'aggregates', 'table', 'rowkey', 'lastdata',
+                 'dependents', 'triggered', 'pending', 'correlatekey', 'flapthreshold',
+                 'Config', 'parent')
+
+    basetype = 'Directive'        # the object can know its own basetype
+    hastokenparser = 1                # tell parser this object has a separate tokenparser()
+
     def __init__(self, toklist):
         # Check toklist for valid tokens
         if len(toklist) < 2:                # need at least 2 tokens
@@ -191,13 +328,10 @@ class Directive(object):
         if len(toklist) == 3:
             self.ID = utils.stripquote(toklist[1])        # grab ID if given
 
-        self.basetype = 'Directive'        # the object can know its own basetype
-        self.type = toklist[0]                # the directive type of this instance
+        self.type = intern(toklist[0])                # the directive type of this instance
 
         self.request_collector()        # request data collector reference
 
-        self.hastokenparser = 1                # tell parser this object has a separate tokenparser()
-
         self.Action = action.action()        # create new action instance
         self.defaultVarDict = {}        # dictionary of variables used by action strings
 
@@ -216,13 +350,14 @@ class Directive(object):
         self.console_output = '%(state)s'
 
         # List of directives this directive is dependent on
-        self.actiondependson = []        # action dependencies
-        self.checkdependson = []        # check dependencies
+        self.actiondependson = ()        # action dependencies
+        self.checkdependson = ()        # check dependencies
 
         # directives keep state information about themselves
         self.state = State(self)
 
         self.requeueTime = None        # specific requeue time can be specified
+        self.ruletimeouts = 0          # consecutive rule evaluation timeouts
 
         self.args.numchecks = 1        # perform only 1 check at a time by default
         self.args.checkwait = 0        # time to wait in between multiple checks
@@ -233,8 +368,17 @@ class Directive(object):
 
         self.history_size = 0        # keep no history by default
         self.history = None        # keep historical data for checks, if required
-
-        self.excludehosts = []        # chris 2002-12-24: hosts to exclude from directive execution
+        self.aggregates = None        # running aggregates for rule functions, if required
+        self.table = None        # table.Table, if evaluating the rule across collector rows
+        self.rowkey = None        # key of the row, if this is a row of a table directive
+        self.lastdata = None        # rule variables of the most recent check
+        self.dependents = ()        # directives to trigger after each check (eg: DERIVED)
+        self.triggered = False        # only re-queued by trigger(), not every scanperiod
+        self.pending = True        # queued and waiting to run (scheduled at startup)
+        self.correlatekey = None        # correlation group for root-cause correlation
+        self.flapthreshold = 0        # status changes in FLAPWINDOW checks to be flapping, 0 is off
+
+        self.excludehosts = ()        # chris 2002-12-24: hosts to exclude from directive execution
         self.actionmaxcalls = None        # chris 2002-12-24: can set limit on number of action calls
         self.performedactions = 0        # chris 2003-10-03: clear actions called flag
 
@@ -261,7 +405,7 @@ class Directive(object):
 
             try:
                 self.data_collectors["%s.%s" % (module, collector)] = \
-                    data_modules.request(module, collector)
+                    data_modules.request(module, collector, self)
             except datacollect.DataModuleError:
                 e = sys.exc_info()
                 log.log("<directive>Directive.request_collector(): error requesting %s.%s, %s %s"
@@ -271,6 +415,17 @@ class Directive(object):
 
         return 1                # ok
 
+    def _getID(self):
+        return self._ID
+
+    def _setID(self, ID):
+        # IDs are shared with State, Config and the console so intern them
+        if isinstance(ID, str):
+            ID = intern(ID)
+        self._ID = ID
+
+    ID = property(_getID, _setID)
+
     def __repr__(self):
         return "%s" % (self.ID)
 
@@ -282,9 +437,9 @@ class Directive(object):
         Set norecurse=1 if recursing parent groups is not required.
         """
 
-        for d in Config.groupDirectives.keys():
-            if ID == Config.groupDirectives[d].ID:
-                return Config.groupDirectives[d]
+        d = Config.groupDirectives.get(ID)        # directives are stored by ID
+        if d is not None:
+            return d
 
         if Config.parent and norecurse == 0:
             return self.getDirective(ID, Config.parent)
@@ -297,9 +452,9 @@ class Directive(object):
         not found.  Return None if not found.
         """
 
-        for g in cfg.groups:
-            if g.name == groupname:
-                return g
+        g = cfg.groupsByName.get(groupname)
+        if g is not None:
+            return g
 
         if cfg.parent:
             return self.getGroup(groupname, cfg.parent)
@@ -328,21 +483,38 @@ class Directive(object):
 
         else:
             # group is specified
-            lookfor = string.split(ID, '.')
+            lookfor = ID.split('.')
             grp = self.getGroup(lookfor[0], cfg)        # get base group
             if not grp:
                 return None
 
             if len(lookfor) > 2:                        # find subsequent groups
                 for g in lookfor[1:-1]:
-                    if g in grp.groups:
-                        grp = grp.groups[g]
-                    else:
+                    grp = grp.groupsByName.get(g)
+                    if grp is None:
                         return None
 
             # now fetch the directive
             return self.getDirective(lookfor[-1], grp, norecurse=1)
 
+    def templateArgs(self, name):
+        """templateArgs: return the Args of the template directive specified
+        by name, as found by findDirective().  Templates are resolved once
+        per group and cached in Config.templateCache.
+        """
+
+        try:
+            return self.Config.templateCache[name]
+        except KeyError:
+            pass
+
+        tpldirective = self.findDirective(name, self.Config)
+        if tpldirective is None:
+            raise ParseFailure("template '%s' not found." % (name))
+
+        self.Config.templateCache[name] = tpldirective.args
+        return tpldirective.args
+
     def tokenparser(self, toklist, toktypes, indent):
         """
         Parse named arguments for directives.  All valid named
@@ -362,26 +534,14 @@ class Directive(object):
 
         # Process template arg first to inherit template arguments
         if 'template' in tokdict.keys():
-            self.args.template = tokdict['template']        # template name
+            template = tokdict['template']        # template name
             del tokdict['template']
-            if self.args.template != 'self':
-                tpldirective = self.findDirective(self.args.template, self.Config)
-                if tpldirective is None:
-                    raise ParseFailure("template '%s' not found."
-                                       % (self.args.template))
-                else:
-                    # copy template directive arguments
-                    for t in dir(tpldirective.args):
-                        if t == 'template':
-                            continue
-                        try:
-                            val = eval('tpldirective.args.%s' % (t))
-                            if isinstance(val, str):
-                                val = utils.type_from_string(val)
-                            exec('self.args.%s = val' % (t))
-                        except:
-                            raise ParseFailure("Error parsing template argument '%s'"
-                                               % t)
+            if template != 'self':
+                # inherit the template directive arguments by lookup rather
+                # than copying them; only this directive's own arguments are
+                # stored in self.args from here on.
+                self.args = Args(parent=self.templateArgs(template))
+            self.args.template = template
 
         for t in tokdict.keys():
             # Use action parser for any of the action lists
@@ -389,6 +549,8 @@ class Directive(object):
                 self.args.act2okList = self.parseAction(tokdict[t])
             elif t == 'actelse':
                 self.args.actelseList = self.parseAction(tokdict[t])
+            elif t == 'actflap':
+                self.args.actflapList = self.parseAction(tokdict[t])
             elif t == 'action':
                 self.args.actionList = self.parseAction(tokdict[t])
             else:
@@ -398,7 +560,7 @@ class Directive(object):
                     val = tokdict[t]
                     if isinstance(val, str):
                         val = utils.type_from_string(val)
-                    exec('self.args.%s = val' % (t))
+                    setattr(self.args, t, val)
                 except:
                     raise ParseFailure("Error parsing argument '%s'" % t)
 
@@ -423,7 +585,7 @@ class Directive(object):
             self.actionperiod = 'scanperiod'        # actionperiod defaults to scanperiod
 
         # test numchecks argument is integer and >= 0
-        if isinstance(self.args.numchecks, int):
+        if not isinstance(self.args.numchecks, int):
             try:
                 self.args.numchecks = int(self.args.numchecks)
             except ValueError:
@@ -435,12 +597,57 @@ class Directive(object):
 
         # convert checkwait to integer seconds if not already
         try:
-            if isinstance(self.args.checkwait, int):
+            if not isinstance(self.args.checkwait, int):
                 self.args.checkwait = utils.val2secs(str(self.args.checkwait))
         except:
             raise ParseFailure("checkwait argument has incorrect value '%s'"
                                % (self.args.checkwait))
 
+        # convert ruletimeout to seconds if not already
+        try:
+            self.args.ruletimeout
+        except AttributeError:
+            pass        # ruletimeout not set, RULETIMEOUT is used
+        else:
+            if not isinstance(self.args.ruletimeout, (int, float)):
+                try:
+                    self.args.ruletimeout = utils.val2secs(str(self.args.ruletimeout))
+                except ValueError:
+                    self.args.ruletimeout = None
+                if self.args.ruletimeout is None:
+                    raise ParseFailure("ruletimeout argument has incorrect value")
+            if self.args.ruletimeout < 0:
+                raise ParseFailure("ruletimeout argument must be >= 0: '%s'"
+                                   % (self.args.ruletimeout))
+
+        # flapthreshold must be an integer between 0 (off) and FLAPWINDOW
+        try:
+            self.flapthreshold = int(self.args.flapthreshold)
+        except AttributeError:
+            pass        # flap detection not enabled
+        except ValueError:
+            raise ParseFailure("flapthreshold argument is not integer: '%s'"
+                               % (self.args.flapthreshold))
+        if self.flapthreshold < 0 or self.flapthreshold > FLAPWINDOW:
+            raise ParseFailure("flapthreshold argument must be between 0 and %d: '%s'"
+                               % (FLAPWINDOW, self.flapthreshold))
+
+        # Set push mode if requested: the directive is checked when its
+        # collectors publish new data rather than every scanperiod.
+        try:
+            push = str(self.args.push).lower()
+        except AttributeError:
+            pass        # push not set, pull data every scanperiod
+        else:
+            if push in ('1', 'true', 'on'):
+                self.triggered = True
+                if self.args.template != 'self':
+                    for c in self.data_collectors.values():
+                        c.subscribe(self)
+            elif push not in ('0', 'false', 'off'):
+                raise ParseFailure("push must be True [1/True/on] or False [0/False/off]: '%s'"
+                                   % (self.args.push))
+
         # Set console_output if possible
         try:
             self.console_output = self.args.console
@@ -456,7 +663,15 @@ class Directive(object):
             raise ParseFailure("history must be an integer: '%s'"
                                % (self.history_size))
         else:
-            self.history = history.History(self.history_size)
+            self.history = history.History(self.history_size, self.historyFields())
+
+        # Keep running aggregates for any aggregate functions in the rule
+        try:
+            self.aggregates = history.Aggregates.fromRule(self.args.rule)
+        except AttributeError:
+            pass        # no rule
+        except ValueError as details:
+            raise ParseFailure("Error in rule aggregate function, %s" % (details))
 
         # Set action dependents if given
         try:
@@ -464,14 +679,22 @@ class Directive(object):
         except AttributeError:
             pass        # no dependents given
         else:
+            deps = []
             for dep in actiondepends_names:
-                d = string.strip(dep)
+                d = dep.strip()
                 directive = self.findDirective(d, self.Config)
                 if directive:
-                    self.actiondependson.append(directive)
+                    deps.append(directive)
                 else:
                     raise ParseFailure("Directive %s, referred to in actiondependson, not found"
                                        % (d))
+            self.actiondependson = tuple(deps)
+
+        # Set the correlation group if given
+        try:
+            self.correlatekey = intern(correlate.key(self, self.args.correlate))
+        except AttributeError:
+            pass        # not correlated
 
         # Set check dependents if given
         try:
@@ -479,23 +702,24 @@ class Directive(object):
         except AttributeError:
             pass        # no dependents given
         else:
+            deps = []
             for dep in checkdepends_names:
-                d = string.strip(dep)
+                d = dep.strip()
                 if d:
                     directive = self.findDirective(d, self.Config)
                     if directive:
-                        self.checkdependson.append(directive)
+                        deps.append(directive)
                     else:
                         raise ParseFailure("Directive '%s', referred to in checkdependson, not found"
                                            % (d))
+            self.checkdependson = tuple(deps)
 
         try:
             excludehosts = self.args.excludehosts.split(',')
         except AttributeError:
             pass        # no excludehosts given
         else:
-            for host in excludehosts:
-                self.excludehosts.append(host.strip())
+            self.excludehosts = tuple([host.strip() for host in excludehosts])
 
         # actionmaxcalls parameter to specify maximum number of
         # times the action(s) will be called for a particular check in
@@ -514,62 +738,41 @@ class Directive(object):
             self.actionmaxcalls = actionmaxcalls
 
         # Set any default action variables
-        if 'rule' in dir(self.args):
+        if hasattr(self.args, 'rule'):
             self.defaultVarDict['rule'] = str(self.args.rule)
 
         # For all of the scalar args defined in the config, populate the
         # defaultVarDict dictionary with them as "_xxx" name, unless they are
         # already defined (don't override existing elements).
         for a in dir(self.args):
-            try:
-                val = eval('self.args.%s' % (a))
-                if type(val) in (type('STRING'), type(1), type(1.1)) and '_' + a not in self.defaultVarDict:
-                    self.defaultVarDict['_' + a] = val
-            except:
-                pass
+            val = getattr(self.args, a)
+            if type(val) in (type('STRING'), type(1), type(1.1)) and '_' + a not in self.defaultVarDict:
+                self.defaultVarDict[intern('_' + a)] = val
 
         if self.args.template == 'self':
             # jump out of token parsing if this is a template only
             raise TemplateDirective
 
-    def evalAction(self, actioncall):
+    def callAction(self, call):
         """
-        Evaluate the given action call.
+        Make the given action call (an actionplan.ActionCall).
         """
 
-        log.log("<directive>Directive.evalAction(): calling action '%s'"
-                % (actioncall), 9)
-
-        # Evaluate action in environment with alias-dictionary to auto
-        # substitute any aliases
-        actionEnv = {}                                # setup action environment
-        actionEnv.update(self.Action.aliasDict)        # add all aliases
-
-        if self.Action.msg:
-            # Get M group needed for this action
-            msgtree = string.split(self.Action.msg, '.')
-            M = self.Action.MDict[msgtree[0]]
-            for m in msgtree[1:]:
-                M = M[m]
+        log.log("<directive>Directive.callAction(): calling action '%s'"
+                % (call), 9)
 
-            actionEnv.update(M.MDict)            # add MSGs
-
-        actionEnv['_Action'] = self.Action       # add Action object
-        acall = "_Action.%s" % (actioncall)      # the string to be evaluated
-
-        evalenv = {}
-        evalenv.update(actionEnv)                # copy actionEnv for eval()
         try:
-            ret = eval(acall, {"__builtins__": {}}, evalenv)       # Call the Action
+            ret = call(self.Action)        # Call the Action
         except:
             # Handle any action evaluation exceptions neatly
             e = sys.exc_info()
             tb = traceback.format_list(traceback.extract_tb(e[2]))
-            log.log("<directive>Directive.evalAction(): Error evaluating %s: %s, %s, %s; actionEnv=%s"
-                    % (acall, e[0], e[1], tb, actionEnv), 5)
+            log.log("<directive>Directive.callAction(): Error calling %s: %s, %s, %s"
+                    % (call, e[0], e[1], tb), 5)
             return
 
         # Update the action reports
+        actioncall = call.text
         self.Action.actionReports[actioncall] = ret
         if ret is None:
             self.Action.varDict['actnm'] = \
@@ -590,40 +793,39 @@ class Directive(object):
         self.Action.state = self.state
         self.Action.aliasDict = Config.aliasDict
 
-        # Perform each action
-        ret = None
+        # Perform each action, compiled once per Config by actionplan
         self.Action.actionReports = {}  # dict of actions and their return status
-        for a in actionList:
-            sre = re.compile("([A-Za-z0-9_]+)\(([A-Za-z0-9_.]+),?([0-9]?)\)")
-            inx = sre.search(a)
-            if inx is None:
-                # Assume we have a simple action call (rather than a
-                # notification definition.
-                self.Action.msg = None
-                self.evalAction(a)
-            else:
+        for (a, step) in zip(actionList, actionplan.plan(Config, actionList)):
+            if step is None:
+                log.log("<directive>Directive.performAction(): notification not defined for '%s'"
+                        % (a), 5)
+                continue
+
+            self.Action.msg = step.msg
+            if step.notif is not None:
                 # Using a Notification object
-                notif = inx.group(1)
-                msg = inx.group(2)
-                level = inx.group(3)
-                if level is None or level == '':
-                    level = '0'
+                self.Action.notif = step.notif
+                self.Action.level = step.level
+                self.Action.MDict = step.MDict
 
-                try:
-                    # Get the actions to execute from the given Level of the N object
-                    afunc = Config.NDict[notif].levels[level]
-                except KeyError:
-                    log.log("<directive>Directive.performAction(): Config.NDict[notif].levels[level], level=%s"
-                            % level, 5)
-                else:
-                    self.Action.notif = notif
-                    self.Action.msg = msg
-                    self.Action.level = level
-                    self.Action.MDict = Config.MDict
+            for call in step.calls:
+                self.callAction(call)
 
-                    aList = utils.tricky_split(afunc[0], ',')
-                    for aa in aList:
-                        self.evalAction(aa)
+    def flapAction(self, changes):
+        """Perform the single notification that this directive has started
+        flapping: the actflap actions if given, otherwise the actions.
+        The flapping variable describes the flapping."""
+
+        try:
+            actionList = self.args.actflapList
+        except AttributeError:
+            actionList = getattr(self.args, 'actionList', None)
+        if not actionList:
+            return
+
+        self.Action.varDict['flapping'] = "%s is flapping: %d status changes in the last %d checks" % (
+            self.ID, changes, FLAPWINDOW)
+        self.performAction(self.Config, actionList)
 
     def doAction(self, cfg, actionList=None):
         """Perform actions for a directive."""
@@ -669,7 +871,7 @@ class Directive(object):
 
         # Make sure there are some actions to perform
         # (they are not always necessary)
-        if 'actionList' in dir(self.args):
+        if hasattr(self.args, 'actionList'):
             self.performedactions = 1     # flag that actions have been called
             self.performAction(cfg, self.args.actionList)
 
@@ -699,7 +901,7 @@ class Directive(object):
         for argline in toklist:
             if len(argline) < 3 or argline[1] != '=':
                 log.log("<directive>Directive.parseArgs(): invalid directive argument '%s'"
-                        % (string.join(argline)), 1)
+                        % (' '.join(argline)), 1)
                 raise ParseFailure("invalid directive argument '%s'"
                                    % (''.join(argline)))
 
@@ -713,6 +915,19 @@ class Directive(object):
     def putInQueue(self, q):
         """Put this directive back into the scheduler queue."""
 
+        if self.rowkey is not None:
+            # rows are not scheduled, their table directive is
+            self.table.requeue(self.requeueTime)
+            self.requeueTime = None
+            return
+
+        if self.triggered and not self.requeueTime:
+            # wait for trigger() unless a specific requeueTime was requested
+            log.log("<directive>Directive.putInQueue(): %s waiting to be triggered"
+                    % (self), 7)
+            return
+        self.pending = True
+
         if self.requeueTime:
             # a specific requeueTime has been requested
             q.put((self, self.requeueTime))
@@ -728,56 +943,90 @@ class Directive(object):
 
     def doDirective(self, cfg, data):
 
+        # If data returned as None, do not perform a check but still
+        # re-schedule directive.
+        if data is None:
+            self.putInQueue(cfg.q)        # put self back in the Queue
+            return
+
+        # Layer the defaultVarDict over the collected data rather than
+        # copying it in.  This get us, among other things, "_xxx" constants.
+        # The same context is used for the rule, the actions and the console.
+        context = utils.VarContext(self.defaultVarDict, data)
+
+        # Update running aggregates with this sample and make the
+        # aggregate functions available to the rule only.
+        rulecontext = context
+        if self.aggregates:
+            self.aggregates.update(context)
+            rulecontext = utils.VarContext(context, self.aggregates.functions)
+
         # If historical data is required
         if self.history:
             if self.history.getsize() < self.history_size:
                 # If historical data is required for check, the directive
                 # must wait until enough data is collected
                 log.log("<directive>Directive.doDirective(): waiting for %d runs to collect enough data for history" % (self.history_size), 7)
-                self.history.push(data)
+                self.history.push(context)
                 self.putInQueue(cfg.q)        # put self back in the Queue
                 return
 
-            # Add historical data to data dictionary
-            data['history'] = self.history
+            # Add historical data to the rule context
+            context['history'] = self.history
 
-        # If data returned as None, do not perform a check but still
-        # re-schedule directive.
-        if data is None:
+        try:
+            result = evalRule(self.args.rule, rulecontext,
+                              getattr(self.args, 'ruletimeout', RULETIMEOUT))
+        except RuleTimeout as details:
+            # Rule is taking too long. Log, mark the state unknown and
+            # back off re-queueing so the rule cannot hog a thread.
+            self.ruletimeouts = self.ruletimeouts + 1
+            backoff = min(2 ** self.ruletimeouts, RULETIMEOUT_MAXBACKOFF)
+            log.log("<directive>Directive.doDirective(): %s RuleTimeout evaluating rule '%s', %s - re-queued in %d secs"
+                    % (self.ID, self.args.rule, details, self.scanperiod * backoff), 3)
+            self.state.status = 'unknown'
+            self.requeueTime = time.time() + self.scanperiod * backoff
             self.putInQueue(cfg.q)        # put self back in the Queue
             return
-
-        # Populate the data dictionary with the defaultVarDict.
-        # This get us, among other things, "_xxx" constants.
-        data.update(self.defaultVarDict)
-
-        try:
-            result = eval(self.args.rule, {}, data)
         except SyntaxError as details:
             # Syntax error evaluating rule. Log and end thread without
             # submitting broken directive back into queue.
             log.log("<directive>Directive.doDirective(): SyntaxError evaluating rule '%s', data=%s - not re-queued"
-                    % (self.args.rule, data), 4)
+                    % (self.args.rule, context), 4)
             return
         except NameError as details:
             # Name error evaluating rule. Log and end thread without
             # submitting broken directive back into queue.
             log.log("<directive>Directive.doDirective(): NameError evaluating rule '%s', %s, data=%s - not re-queued"
-                    % (self.args.rule, details, data), 4)
+                    % (self.args.rule, details, context), 4)
             return
 
-        # Create action string substitution variables.
-        # These are a dictionary of data-collection variables along with any
-        # extra variables added specifically by the Directive itself.
-        self.Action.varDict = {}
-        self.Action.varDict.update(data)
+        self.ruletimeouts = 0
+
+        self.processResult(cfg, context, result, data)
+
+    def processResult(self, cfg, context, result, data):
+        """Update the directive state from the rule result of a check,
+        performing actions if it failed, then re-queue the directive.
+        context holds the rule variables, data the collected data.
+        """
+
+        # Action string substitution variables are the rule context.
+        # Any extra variables added specifically by the Directive itself
+        # are stored in the context and do not touch the collected data.
+        self.Action.varDict = context
         self.addVariables()
 
         if result is False:
             self.state.stateok(cfg)        # update state info for check passed
+            correlate.correlator.resolve(self)
+            self.lastdata = context
+            self.triggerDependents(cfg)
 
         else:
             self.state.statefail()        # update state info for check failed
+            self.lastdata = context
+            self.triggerDependents(cfg)
 
             log.log("<directive>Directive.doDirective(): %s rule failed, calling doAction()" % (self.ID), 7)
             # If any dependencies are also failed, running actions for this
@@ -786,6 +1035,12 @@ class Directive(object):
             if failed_deps:
                 log.log("<directive>Directive.doDirective(): dependencies %s failed, %s not calling actions"
                         % (failed_deps, self.ID), 7)
+            elif self.state.flapping:
+                log.log("<directive>Directive.doDirective(): %s flapping, not calling actions"
+                        % (self.ID), 7)
+            elif self.state.status == 'fail' and correlate.correlator.suppress(self):
+                log.log("<directive>Directive.doDirective(): %s correlated with an incident, not calling actions"
+                        % (self.ID), 7)
             else:
                 if self.actionmaxcalls is not None and self.Action.runcount >= self.actionmaxcalls:
                     log.log("<directive>Directive.doDirective(): actionmaxcalls reached (%d) - actions skipped"
@@ -793,6 +1048,8 @@ class Directive(object):
                     self.putInQueue(cfg.q)        # put self back in the Queue
                     return
                 else:
+                    if self.correlatekey is not None:
+                        context['incident'] = correlate.correlator.incident(self)
                     self.doAction(cfg)
                     self.Action.runcount = self.Action.runcount + 1
                     log.log("<directive>Directive.doDirective(): Action.runcount=%d"
@@ -800,13 +1057,143 @@ class Directive(object):
 
         # Save historical data
         if self.history:
-            del data['history']                        # Remove old history data
-            self.history.push(data)
+            del context['history']                        # Remove old history data
+            self.history.push(context)
 
         self.postAction(data)                # perform any post-action processing
 
         self.putInQueue(cfg.q)        # put self back in the Queue
 
+    def trigger(self, cfg):
+        """Queue this directive to run now, unless it is already queued.
+        Called when new data is available for it, eg: by a collector in
+        push mode or by the inputs of a DERIVED directive.
+        """
+
+        if self.pending:
+            return
+        self.pending = True
+        cfg.q.put((self, time.time()))
+        log.log("<directive>Directive.trigger(): %s queued" % (self), 8)
+
+    def triggerDependents(self, cfg):
+        """Tell directives using the result of this one (see DERIVED) that
+        a check has completed."""
+
+        for d in self.dependents:
+            d.trigger(cfg)
+
+    def setTable(self, keyname, pattern):
+        """Called by a directive tokenparser with the argument (keyname) and
+        value (pattern) selecting the collector row to check.  If pattern
+        is a wildcard, eg: fs='*', the directive checks every matching row,
+        keeping state and performing actions per row.  Directives
+        supporting this must define getTable().
+        """
+
+        if table.isPattern(pattern):
+            self.table = table.Table(keyname, pattern, getattr(self.args, 'rule', None))
+
+    def getTable(self):
+        """
+        Return a dictionary of row key to data dictionary for all rows
+        matching self.table.pattern, or None if no check should be
+        performed.
+
+        This function must be overloaded by Directive sub-classes
+        supporting table mode.
+        """
+
+        raise DirectiveError("%s does not support wildcard %s"
+                             % (self.type, self.table.keyname))
+
+    def getRow(self, key):
+        """Return the row directive for row key of a table directive,
+        creating it if this row has not been seen before.  Rows share the
+        directive arguments but keep their own state, actions and history.
+        """
+
+        try:
+            return self.table.rows[key]
+        except KeyError:
+            pass
+
+        row = copy.copy(self)
+        row.rowkey = key
+        row.ID = '%s[%s]' % (self.ID, key)
+        row.state = State(row)
+        row.state.ID = row.ID
+        row.Action = action.action()
+        row.defaultVarDict = dict(self.defaultVarDict)
+        row.defaultVarDict[self.table.keyname] = key
+        row.requeueTime = None
+        row.ruletimeouts = 0
+        row.current_actionperiod = 0
+        row.lastactiontime = 0
+        row.performedactions = 0
+        row.lastdata = None
+        row.dependents = ()        # the table directive triggers them
+        if self.history is not None:
+            row.history = history.History(self.history_size, self.history.keep)
+        if self.aggregates is not None:
+            row.aggregates = history.Aggregates.fromRule(self.args.rule)
+
+        self.table.rows[key] = row
+        log.log("<directive>Directive.getRow(): %s added row '%s'" % (self.ID, key), 7)
+        return row
+
+    def doTable(self, cfg, rows):
+        """Check each row of a table directive; rows is a dictionary of
+        row key to data dictionary, as returned by getTable().
+
+        If the rule is simple enough (see table.TableRule) it is evaluated
+        for all rows in one pass, otherwise each row is checked in turn.
+        """
+
+        if rows is None:
+            self.putInQueue(cfg.q)        # put self back in the Queue
+            return
+
+        # forget rows which are no longer there
+        for key in list(self.table.rows.keys()):
+            if key not in rows:
+                del self.table.rows[key]
+
+        keys = sorted(rows.keys())
+        self.table.queued = 0
+        self.table.requeueTime = None
+
+        results = None
+        if self.table.rule is not None and self.history is None and self.aggregates is None:
+            contexts = [utils.VarContext(self.getRow(k).defaultVarDict, rows[k]) for k in keys]
+            results = self.table.rule.evaluate(contexts)
+
+        if results is None:
+            for k in keys:
+                self.getRow(k).doDirective(cfg, rows[k])
+        else:
+            for (k, context, result) in zip(keys, contexts, results):
+                self.getRow(k).processResult(cfg, context, result, rows[k])
+
+        # Table state summarises the rows
+        states = [r.state for r in self.table.rows.values()]
+        if [s for s in states if s.status in ('fail', 'failinitial')]:
+            self.state.status = 'fail'
+        elif [s for s in states if s.status == 'ok']:
+            self.state.status = 'ok'
+        else:
+            self.state.status = 'unknown'
+        self.state.checkcount = max([s.checkcount for s in states] + [0])
+        self.triggerDependents(cfg)
+
+        if keys and self.table.queued == 0:
+            # every row stopped, eg: on a rule error
+            log.log("<directive>Directive.doTable(): %s no rows re-queued - not re-queued" % (self.ID), 4)
+            return
+
+        self.requeueTime = self.table.requeueTime
+        self.putInQueue(cfg.q)        # put self back in the Queue
+
     def safeCheck(self, cfg):
         """
         This function is called to start a new checking thread for a directive.
@@ -822,7 +1209,7 @@ class Directive(object):
                     % (self.state.ID), 5)
             return
 
-        self.last_check_time = time.localtime(time.time())        # note time of last check
+        self.last_check_time = time.time()        # note time of last check
 
         try:
             self.docheck(cfg)
@@ -859,9 +1246,11 @@ class Directive(object):
         discarded (not re-scheduled).
         """
 
+        self.pending = False        # any new data from now on triggers another check
+
         # If checktime specified, evaluate and don't run this
         # directive if outside time rule specified
-        if 'checktime' in dir(self.args):
+        if hasattr(self.args, 'checktime'):
             # Setup variables used to evaluate the checktime rule
             timevars = {}
             # get time() once, to prevent possible race condition
@@ -904,14 +1293,18 @@ class Directive(object):
 
         # If this is the second or subsequent check of a re-check, refresh the data
         if self.state.checkcount > 0:
-            for i in self.data_collectors.keys():
-                self.data_collectors[i].refresh()  # force refresh of data if re-checking
+            for (name, c) in self.data_collectors.items():
+                c.recheck(self.recheckKey(name))        # refresh data if re-checking
 
         # self.getData() must be supplied by Directive sub-class.
         # It must fetch the required data (if any) somehow...
         # All fetched data should be returned in a dictionary.
+        # In table mode, self.getTable() fetches the data of every row instead.
         try:
-            data = self.getData()
+            if self.table is not None:
+                data = self.getTable()
+            else:
+                data = self.getData()
         except DirectiveError as err:
             # Critical directive error, log message and end directive thread.
             # (Directive will not be re-scheduled.)
@@ -919,7 +1312,87 @@ class Directive(object):
                     % (self.ID, err), 4)
             return
 
-        self.doDirective(cfg, data)
+        if self.table is not None:
+            self.doTable(cfg, data)
+        else:
+            self.doDirective(cfg, data)
+
+    def recheckKey(self, collector):
+        """
+        Return the key of the collector data this directive checks, so a
+        re-check can refresh only that key (see DataCollect.recheck()), or
+        None to refresh all the collector data.
+
+        This function can be overloaded by the Directive sub-class.
+        """
+
+        return None
+
+    def historyFields(self):
+        """
+        Return the set of variable names to keep in the directive history:
+        those given by the historyfields argument (comma-separated), else
+        those the rule reads from history samples, or None to keep all.
+        """
+
+        try:
+            names = self.args.historyfields
+        except AttributeError:
+            pass
+        else:
+            if not isinstance(names, str):
+                raise ParseFailure("historyfields must be a comma-separated string: '%s'" % (names,))
+            return frozenset([n.strip() for n in names.split(',') if n.strip()])
+
+        try:
+            return history.fieldsFromRule(self.args.rule)
+        except AttributeError:
+            return None        # no rule
+
+    def historyMemory(self):
+        """Return an estimate of the memory used by the directive history,
+        in bytes, 0 if it keeps none."""
+
+        if self.history is None:
+            return 0
+        return self.history.memory()
+
+    def fields(self):
+        """
+        Return the set of names this directive may read from its collector
+        data: those of its rule, and the variables its arguments and the
+        messages, notifications and aliases of its group refer to.  Return
+        None if the directive has no rule, as any field may then be used.
+
+        Collectors skip fields no directive uses (see
+        DataCollect.alignFields()), so a sub-class using collector data
+        some other way must extend this.
+        """
+
+        try:
+            rule = self.args.rule
+        except AttributeError:
+            return None
+        if not isinstance(rule, str):
+            return None
+        try:
+            names = set(compile(rule.strip(), '<rule>', 'eval').co_names)
+        except (SyntaxError, ValueError):
+            return None
+
+        texts = [v for v in self.defaultVarDict.values() if isinstance(v, str)]
+        for arg in dir(self.args):
+            value = getattr(self.args, arg)
+            if isinstance(value, str):
+                texts.append(value)
+            elif isinstance(value, (list, tuple)):
+                texts.extend([v for v in value if isinstance(v, str)])
+        for t in texts:
+            names.update(utils.template_names(t))
+        Config = getattr(self, 'Config', None)
+        if Config is not None:
+            names.update(Config.templateNames())
+        return names
 
     def addVariables(self):
         """
@@ -954,37 +1427,30 @@ class Directive(object):
         if text is None:
             return None
 
-        # Setup variables available to console_output string
-        svars = {}
-
-        # If the action was never-ever called, we need to get those vars populated
-        # (otherwise, Action.varDict should already contain all of defaultVarDict).
-        svars.update(self.defaultVarDict)
-
-        # add all the action variables
-        svars.update(self.Action.varDict)
+        # Setup variables available to console_output string: the action
+        # variables, falling back to defaultVarDict if the action was
+        # never-ever called (otherwise, Action.varDict already layers it).
+        svars = utils.VarContext(self.Action.varDict, self.defaultVarDict)
 
         # Note that if doDirective never got to execute the action, there can still be KeyError issues.
 
         # add the current state
         svars['state'] = self.state.status
+        svars['flapping'] = self.state.flapping and 'flapping' or ''
+        svars['historybytes'] = self.historyMemory()
 
         # add time of last check
         try:
-            t = self.last_check_time
-            svars['lastchecktime'] = \
-                "%04d/%02d/%02d %d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
+            svars['lastchecktime'] = utils.format_time(self.last_check_time)
         except AttributeError:
             svars['lastchecktime'] = "<not yet run>"
 
         # add the lastfailtime and faildetecttime
         if self.state.status == "fail":
-            t = self.state.faildetecttime
             svars['problemfirstdetect'] = \
-                "First detected: %04d/%02d/%02d %d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
-            t = self.state.lastfailtime
+                "First detected: %s" % utils.format_time(self.state.faildetecttime)
             svars['problemlastfail'] = \
-                "Last detected: %04d/%02d/%02d %d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
+                "Last detected: %s" % utils.format_time(self.state.lastfailtime)
         else:
             svars['problemfirstdetect'] = ""
             svars['problemlastfail'] = ""
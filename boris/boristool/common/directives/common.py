@@ -11,7 +11,7 @@ import traceback
 import errno
 import re
 
-from boristool.common import directive, log, utils
+from boristool.common import directive, log, table, utils
 
 
 # Directives
@@ -21,8 +21,14 @@ class FS(directive.Directive):
     FS allows filesystem checks to be performed.
 
     It requires the 'dfList' class from the 'df' data-collection module.
+
+    If fs is a wildcard pattern, eg: fs='*' or fs='/var*', every filesystem
+    with a matching mount point or device is checked, each keeping its own
+    state and calling actions separately.  %(fs)s holds its mount point.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         # FS requires the dfList collector object from the df module
         self.need_collectors = (('df', 'dfList'),)  # (module, collector-class) required
@@ -54,6 +60,8 @@ class FS(directive.Directive):
             self.ID = '%s.FS.%s' % (log.hostname, self.args.fs)
         self.state.ID = self.ID
 
+        self.setTable('fs', self.args.fs)
+
         log.log("<directive>FS.tokenparser(): ID '%s' fs '%s' rule '%s'" %
                 (self.state.ID, self.args.fs, self.args.rule), 8)
 
@@ -77,12 +85,37 @@ class FS(directive.Directive):
         else:
             return df.getHash()
 
+    def getTable(self):
+        """
+        Called by Directive docheck() method in table mode to fetch the data
+        of every filesystem matching the fs pattern, keyed by mount point.
+        """
+
+        rows = {}
+        for (mountpt, df) in self.data_collectors['df.dfList'].getHash('mounthash').items():
+            if table.match(self.table.pattern, mountpt, df.data['fsname']):
+                rows[mountpt] = df.getHash()
+        return rows
+
+    def recheckKey(self, collector):
+        """
+        Re-checks only refresh the usage of the filesystem checked.
+        """
+
+        if self.table is not None:
+            return None
+        return self.args.fs
+
     def addVariables(self):
         """
         Add directive-specific action variables.
         """
 
-        self.Action.varDict['df'] = str(self.data_collectors['df.dfList'][self.args.fs])
+        if self.rowkey is not None:
+            fs = self.rowkey
+        else:
+            fs = self.args.fs
+        self.Action.varDict['df'] = str(self.data_collectors['df.dfList'][fs])
 
 
 class PID(directive.Directive):
@@ -92,6 +125,8 @@ class PID(directive.Directive):
     It requires the 'procList' class from the 'proc' data-collection module.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         # PID requires the procList collector object from the proc module
         self.need_collectors = (('proc', 'procList'),)  # (module, collector-class) required
@@ -164,6 +199,8 @@ class PROC(directive.Directive):
     It requires the 'procList' class from the 'proc' data-collection module.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         # PROC requires the procList collector object from the proc module
         self.need_collectors = (('proc', 'procList'),)   # (module, collector-class) required
@@ -226,6 +263,8 @@ class SP(directive.Directive):
     It requires the 'TCPtable' class from the 'netstat' data-collection module.
     """
 
+    __slots__ = ('port_n', 'port')
+
     def __init__(self, toklist):
         # SP requires the TCPtable and UDPtable collectors from the netstat module
         self.need_collectors = (('netstat','TCPtable'), ('netstat','UDPtable'))
@@ -319,6 +358,8 @@ class COM(directive.Directive):
     It requires no data-collection modules.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         super(COM, self).__init__(toklist)
 
@@ -427,6 +468,8 @@ class PORT(directive.Directive):
     It requires no data-collection modules.
     """
 
+    __slots__ = ('regexp',)
+
     def __init__(self, toklist):
         super(PORT, self).__init__(toklist)
 
@@ -586,6 +629,8 @@ class IF(directive.Directive):
     It requires the 'IntTable' class from the 'netstat' data-collection module.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         # IF requires the IntTable collector object from the netstat module
         self.need_collectors = (('netstat', 'IntTable'),)  # (module, collector-class) required
@@ -642,6 +687,8 @@ class NET(directive.Directive):
     It requires the 'stats_ctrs' class from the 'netstat' data-collection module.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         # NET requires the stats_ctrs collector object from the netstat module
         self.need_collectors = (('netstat', 'stats_ctrs'),)  # (module, collector-class) required
@@ -693,6 +740,8 @@ class SYS(directive.Directive):
     It requires the 'system' class from the 'system' data-collection module.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         # SYS requires the system collector object from the system module
         self.need_collectors = (('system', 'system'),)  # (module, collector-class) required
@@ -747,6 +796,8 @@ class STORE(directive.Directive):
      directive to call the elvindb() action is sorted out.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         self.need_collectors = (
             ('system', 'system'),
@@ -808,3 +859,104 @@ class STORE(directive.Directive):
             return None
 
         return datahash
+
+
+class DirectiveResult(object):
+    """The latest result of a directive, as seen by a DERIVED rule: the
+    directive status plus its rule variables as attributes,
+    eg: web.status, load.loadavg1
+    """
+
+    __slots__ = ('status', 'data')
+
+    def __init__(self, d):
+        self.status = d.state.status
+        self.data = d.lastdata
+
+    def __getattr__(self, name):
+        try:
+            return self.data[name]
+        except (KeyError, TypeError):
+            raise AttributeError(name)
+
+    def __str__(self):
+        return self.status
+
+
+class DERIVED(directive.Directive):
+    """
+    DERIVED evaluates a rule over the latest results of other directives,
+    without collecting any data itself.  The inputs are given as
+    alias=directive pairs, each alias being available to the rule as the
+    status and rule variables of that directive.
+
+    A DERIVED directive is checked whenever one of its inputs completes a
+    check, not every scanperiod.  Inputs must be defined before the DERIVED
+    directive using them.
+
+    Example:
+
+        DERIVED web_overloaded:
+            inputs='web=web_port,load=sysload'
+            rule="web.status != 'ok' and load.loadavg1 > 10"
+            action=email('root', 'web port down with load %(load)s')
+    """
+
+    __slots__ = ('inputs',)
+
+    def __init__(self, toklist):
+        super(DERIVED, self).__init__(toklist)
+        self.inputs = ()
+        self.triggered = True        # only checked when triggered by inputs
+
+    def tokenparser(self, toklist, toktypes, indent):
+        super(DERIVED, self).tokenparser(toklist, toktypes, indent)
+
+        # test required arguments
+        try:
+            self.args.inputs
+        except AttributeError:
+            raise directive.ParseFailure("Inputs not specified")
+        try:
+            self.args.rule
+        except AttributeError:
+            raise directive.ParseFailure("Rule not specified")
+
+        self.defaultVarDict['rule'] = self.args.rule
+
+        # define the unique ID
+        if self.ID is None:
+            self.ID = '%s.DERIVED.%s' % (log.hostname, self.args.rule)
+        self.state.ID = self.ID
+
+        inputs = []
+        for i in self.args.inputs.split(','):
+            try:
+                (alias, name) = [n.strip() for n in i.split('=')]
+            except ValueError:
+                raise directive.ParseFailure("DERIVED input must be alias=directive: '%s'" % (i))
+            d = self.findDirective(name, self.Config)
+            if d is None:
+                raise directive.ParseFailure("Directive '%s', referred to in inputs, not found"
+                                             % (name))
+            inputs.append((alias, d))
+            if self not in d.dependents:
+                d.dependents = d.dependents + (self,)
+        self.inputs = tuple(inputs)
+
+        log.log("<directive>DERIVED.tokenparser(): ID '%s' inputs '%s' rule '%s'" %
+                (self.state.ID, self.args.inputs, self.args.rule), 8)
+
+    def getData(self):
+        """
+        Called by Directive docheck() method to fetch the data required for
+        evaluating the directive rule: the latest results of the inputs.
+        """
+
+        data = {}
+        for (alias, d) in self.inputs:
+            if d.state.status == 'unknown' and d.lastdata is None:
+                log.log("<directive>DERIVED.getData(): input '%s' not checked yet" % (alias), 7)
+                return None
+            data[alias] = DirectiveResult(d)
+        return data
@@ -1,6 +1,6 @@
 __doc__ = """Disk directives"""
 
-from boristool.common import directive, log, utils
+from boristool.common import directive, log, table, utils
 
 
 class DISK(directive.Directive):
@@ -16,8 +16,13 @@ class DISK(directive.Directive):
             scanperiod='5m'
             rule='True'        # always perform action
             action=notify('BORIS Disk Thruput', '%(device)s rbytes=%(read_bytes)s wbytes=%(write_bytes)s')
+
+    A wildcard device, eg: device='sd*', checks every matching device,
+    keeping state and calling actions for each separately.
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         self.need_collectors = (('diskdevice', 'DiskStatistics'),)
         super(DISK, self).__init__(toklist)
@@ -43,6 +48,8 @@ class DISK(directive.Directive):
             self.ID = '%s.DISK.%s' % (log.hostname, self.args.device)
         self.state.ID = self.ID
 
+        self.setTable('device', self.args.device)
+
         log.log("<disk>DISK.tokenparser(): ID '%s' device '%s' rule '%s'" %
                 (self.state.ID, self.args.device, self.args.rule), 8)
 
@@ -57,4 +64,14 @@ class DISK(directive.Directive):
                     (self.args.device), 4)
             return None
         else:
-            return disk.getHash()
\ No newline at end of file
+            return disk.getHash()
+    def getTable(self):
+        """Called by Directive docheck() method in table mode to fetch the
+        data of every device matching the device pattern.
+        """
+
+        rows = {}
+        for (name, disk) in self.data_collectors['diskdevice.DiskStatistics'].getHash().items():
+            if table.match(self.table.pattern, name):
+                rows[name] = disk.getHash()
+        return rows
@@ -19,6 +19,8 @@ class RPI(directive.Directive):
             action=spreadrrd('sensor-%(h)s', 'temperature=%(temperature)s,humidity=%(humidity)s')
     """
 
+    __slots__ = ()
+
     def __init__(self, toklist):
         self.need_collectors = (('rpi', 'DHTData'),)
         super(RPI, self).__init__(toklist)
@@ -1,38 +1,149 @@
 
 from __future__ import absolute_import
 
+import ast
+import bisect
+import math
+import sys
 import threading
+import time
+from array import array
+from collections import deque
+
+from .. _compat import long, string_types
 from . import log
 
 
-# Container of data
-class Hist:
-    pass
+# Rule functions computed from running aggregates (see Aggregates)
+WINDOWFUNCS = ('avg', 'min', 'max', 'p95')
+SAMPLEFUNCS = ('rate', 'delta')
+
+
+# Array typecodes for columns of numbers; other values are kept in lists
+TYPECODES = {float: 'd', int: 'q'}
+try:
+    array('q')
+except ValueError:
+    TYPECODES[int] = 'l'        # no long long arrays
+
+
+class Column(object):
+    """One variable of a fixed capacity ring buffer, stored in an array if
+    it holds numbers of one type, otherwise in a list.  A column changes
+    to a list the first time it is given a value of another type.
+    """
+
+    __slots__ = ('kind', 'values')
+
+    def __init__(self, size, value):
+        self.kind = type(value)        # type of every value in an array, None for a list
+        code = TYPECODES.get(self.kind)
+        if code is None:
+            self.kind = None
+            self.values = [None] * size
+        else:
+            self.values = array(code, [0]) * size
+
+    def __setitem__(self, slot, value):
+        if self.kind is not None and type(value) is not self.kind:
+            self.tolist()
+        try:
+            self.values[slot] = value
+        except OverflowError:
+            self.tolist()
+            self.values[slot] = value
+
+    def __getitem__(self, slot):
+        return self.values[slot]
+
+    def tolist(self):
+        self.kind = None
+        self.values = list(self.values)
+
+
+class Record(object):
+    """A view of one sample in a History: history[1].x is the variable x
+    of the newest sample.
+    """
+
+    __slots__ = ('_history', '_seq')
+
+    def __init__(self, history, seq):
+        self._history = history
+        self._seq = seq
+
+    def __getattr__(self, name):
+        return self._history.value(self._seq, name)
+
+    def getHash(self):
+        """Return a dictionary of all the variables of the sample."""
+
+        h = self._history
+        return dict([(name, h.value(self._seq, name)) for name in h.fields[self._seq % h.size]])
+
+    def __repr__(self):
+        return "%s" % (self.getHash(), )
 
 
 # Store a list of historical data
-class History:
-    def __init__(self, size):
+class History(object):
+    """The last size samples pushed by a directive, in a ring buffer of
+    columns, for rules like:
+
+        rule='history[1].x < x'
+
+    history[1] is the newest sample.  push() is O(1) in size and memory
+    is fixed by size and the number of variables.  Pushes are serialised;
+    readers take no lock, and a sample overwritten while it is being
+    read raises IndexError rather than returning a newer value.
+
+    If keep is given, only the variables named in it are stored (see
+    fieldsFromRule()).
+    """
+
+    __slots__ = ('size', 'count', 'columns', 'fields', 'seqs', 'push_lock', 'keep')
+
+    def __init__(self, size, keep=None):
         self.size = size
-        self.history = []
-        self.history_semaphore = threading.Semaphore()
+        self.count = 0                    # number of samples ever pushed
+        self.columns = {}                 # variable name -> Column
+        self.fields = [None] * size       # variable names of the sample in each slot
+        self.seqs = [0] * size            # number of the sample in each slot, 0 if none
+        self.push_lock = threading.Lock()
+        self.keep = keep                  # names of the variables stored, None for all
 
     def push(self, data):
-        self.history_semaphore.acquire()        # Thread safety
+        if self.size < 1:
+            return
+
+        with self.push_lock:        # Thread safety
+            seq = self.count + 1
+            slot = seq % self.size
+            self.seqs[slot] = 0        # invalidate the slot for readers while it changes
 
-        h = Hist()
-        for d in list(data.keys()):
-            exec("h.%s = data[d]" % (d))
-        self.history.insert(0, h)        # add new data to front of list
-        if len(self.history) > self.size:
-            self.history.pop()                # remove oldest data
+            if self.keep is None:
+                fields = frozenset(data.keys())
+            else:
+                fields = self.keep.intersection(data.keys())
+            previous = self.fields[(seq - 1) % self.size]
+            if fields == previous:
+                fields = previous        # share the set of names between samples
+            for name in fields:
+                value = data[name]
+                try:
+                    self.columns[name][slot] = value
+                except KeyError:
+                    column = self.columns[name] = Column(self.size, value)
+                    column[slot] = value
+            self.fields[slot] = fields
 
-        self.history_semaphore.release()
+            self.seqs[slot] = seq
+            self.count = seq
 
         log.log("<history>History.push(): Added data %s" % (data, ), 8)
 
     def getsize(self):
-        return len(self.history)
+        return min(self.count, self.size)
 
     def __getitem__(self, index):
         if index < 1 or index > self.size:
@@ -40,12 +151,301 @@ class History:
                     (index), 4)
             return None
 
-        self.history_semaphore.acquire()        # Thread safety
-        data = self.history[index-1]
-        self.history_semaphore.release()
+        seq = self.count - index + 1
+        if seq < 1:
+            raise IndexError("history index out of range: %d" % (index))
+        data = Record(self, seq)
         log.log("<history>History.__getitem__(): fetched history[%d]=%s"%
                 (index, data), 8)
         return data
 
+    def value(self, seq, name):
+        """Return variable name of sample number seq."""
+
+        slot = seq % self.size
+        fields = self.fields[slot]
+        value = None
+        if fields is not None and name in fields:
+            value = self.columns[name][slot]
+        if self.seqs[slot] != seq:
+            raise IndexError("history sample %d no longer available" % (seq))
+        if fields is None or name not in fields:
+            raise AttributeError(name)
+        return value
+
+    def memory(self):
+        """Return an estimate of the memory used by the history, in bytes."""
+
+        total = sys.getsizeof(self.fields) + sys.getsizeof(self.seqs)
+        names = {}
+        for fields in self.fields:
+            if fields is not None:
+                names[id(fields)] = fields
+        total = total + sum([sys.getsizeof(f) for f in names.values()])
+        for column in list(self.columns.values()):
+            total = total + sys.getsizeof(column.values)
+            if column.kind is None:
+                total = total + sum([sys.getsizeof(v) for v in column.values if v is not None])
+        return total
+
     def __repr__(self):
-        return "%s" % self.history
+        return "%s" % ([self[i] for i in range(1, self.getsize() + 1)], )
+
+
+def fieldsFromRule(rule):
+    """Return the set of variable names rule reads from history samples,
+    as in 'history[1].x', or None if it uses history any other way (eg:
+    history[1].getHash()) or does not parse.
+    """
+
+    try:
+        tree = ast.parse(rule.strip(), mode='eval')
+    except (SyntaxError, AttributeError):
+        return None
+
+    parents = {}
+    for node in ast.walk(tree):
+        for child in ast.iter_child_nodes(node):
+            parents[child] = node
+
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Name) or node.id != 'history':
+            continue
+        sub = parents.get(node)
+        if not isinstance(sub, ast.Subscript) or sub.value is not node:
+            return None
+        attr = parents.get(sub)
+        if not isinstance(attr, ast.Attribute) or attr.attr == 'getHash':
+            return None
+        names.add(attr.attr)
+    return frozenset(names)
+
+
+# Running aggregates over a window of samples of one variable
+class Window(object):
+    """Keep the sum, minimum, maximum and (optionally) the sorted values of
+    the last size samples of a variable.  Each push() is O(1) amortised
+    (O(size) memmove for the sorted values), and each aggregate is read
+    without looking at the samples again.
+    """
+
+    __slots__ = ('size', 'values', 'total', 'count', 'maxq', 'minq', 'ordered')
+
+    def __init__(self, size, ordered=False):
+        self.size = size
+        self.values = deque()        # samples in the window, oldest first
+        self.total = 0                # sum of samples in the window
+        self.count = 0                # number of samples ever pushed
+        self.maxq = deque()        # (count, value) candidates for max, decreasing
+        self.minq = deque()        # (count, value) candidates for min, increasing
+        self.ordered = None        # samples in the window, sorted, for percentiles
+        if ordered:
+            self.ordered = []
+
+    def push(self, value):
+        self.count = self.count + 1
+        self.values.append(value)
+        self.total = self.total + value
+
+        while self.maxq and self.maxq[-1][1] <= value:
+            self.maxq.pop()
+        self.maxq.append((self.count, value))
+        while self.minq and self.minq[-1][1] >= value:
+            self.minq.pop()
+        self.minq.append((self.count, value))
+
+        if self.ordered is not None:
+            bisect.insort(self.ordered, value)
+
+        if len(self.values) > self.size:
+            old = self.values.popleft()
+            self.total = self.total - old
+            if self.ordered is not None:
+                del self.ordered[bisect.bisect_left(self.ordered, old)]
+
+        expired = self.count - self.size
+        while self.maxq[0][0] <= expired:
+            self.maxq.popleft()
+        while self.minq[0][0] <= expired:
+            self.minq.popleft()
+
+    def avg(self):
+        return float(self.total) / len(self.values)
+
+    def max(self):
+        return self.maxq[0][1]
+
+    def min(self):
+        return self.minq[0][1]
+
+    def percentile(self, pct):
+        """Nearest-rank percentile of the samples in the window."""
+        rank = int(math.ceil(pct / 100.0 * len(self.ordered)))
+        return self.ordered[max(rank, 1) - 1]
+
+
+class Aggregates(object):
+    """Running aggregates of the variables used by the aggregate functions
+    of a directive rule, eg:
+
+        rule='avg("loadavg1", 5) > 4 or rate("ctxt") > 10000'
+
+    Windows are created for each (variable, size) found in the rule when it
+    is parsed (see fromRule()) and updated with every sample collected by
+    the directive, so rule functions never recompute over the window.
+
+    Available rule functions, taking the variable name as a string:
+     avg(var, N)   - average of the last N samples
+     max(var, N)   - maximum of the last N samples
+     min(var, N)   - minimum of the last N samples
+     p95(var, N)   - 95th percentile of the last N samples
+     rate(var)     - change per second between the last two samples
+     delta(var)    - change between the last two samples
+    max() and min() behave as the builtins when not given a variable name.
+    """
+
+    def __init__(self):
+        self.windows = {}        # (var, size) -> Window
+        self.samples = {}        # var -> [(time, value), (time, value)], for rate/delta
+        self.functions = {
+            'avg': self.avg,
+            'max': self.max,
+            'min': self.min,
+            'p95': self.p95,
+            'rate': self.rate,
+            'delta': self.delta,
+        }
+
+    def __len__(self):
+        return len(self.windows) + len(self.samples)
+
+    def track(self, func, var, size=None):
+        """Maintain the aggregates needed by rule function func for var."""
+
+        if func in SAMPLEFUNCS:
+            self.samples.setdefault(var, [])
+            return
+        w = self.windows.get((var, size))
+        if w is None:
+            w = self.windows[(var, size)] = Window(size, ordered=(func == 'p95'))
+        elif func == 'p95' and w.ordered is None:
+            w.ordered = sorted(w.values)
+
+    def update(self, data, now=None):
+        """Add the current sample of every tracked variable found in data."""
+
+        if now is None:
+            now = time.time()
+        for ((var, size), w) in self.windows.items():
+            value = data.get(var)
+            if isinstance(value, (int, long, float)):
+                w.push(value)
+        for (var, last) in self.samples.items():
+            value = data.get(var)
+            if isinstance(value, (int, long, float)):
+                last.append((now, value))
+                if len(last) > 2:
+                    del last[0]
+
+    def window(self, func, var, size):
+        try:
+            w = self.windows[(var, size)]
+        except KeyError:
+            raise NameError("%s(): no window of %s samples kept for '%s'"
+                            % (func, size, var))
+        if not w.values:
+            raise NameError("%s(): no samples collected yet for '%s'"
+                            % (func, var))
+        return w
+
+    def avg(self, var, size):
+        return self.window('avg', var, size).avg()
+
+    def p95(self, var, size):
+        return self.window('p95', var, size).percentile(95)
+
+    def max(self, *args, **kwargs):
+        if len(args) == 2 and (args[0], args[1]) in self.windows:
+            return self.window('max', args[0], args[1]).max()
+        return max(*args, **kwargs)
+
+    def min(self, *args, **kwargs):
+        if len(args) == 2 and (args[0], args[1]) in self.windows:
+            return self.window('min', args[0], args[1]).min()
+        return min(*args, **kwargs)
+
+    def last2(self, func, var):
+        try:
+            last = self.samples[var]
+        except KeyError:
+            raise NameError("%s(): samples not kept for '%s'" % (func, var))
+        if len(last) < 2:
+            return None
+        return last
+
+    def delta(self, var):
+        """Change in var between the last two samples, 0 until there are two."""
+        last = self.last2('delta', var)
+        if last is None:
+            return 0
+        return last[1][1] - last[0][1]
+
+    def rate(self, var):
+        """Change in var per second between the last two samples, 0 until
+        there are two."""
+        last = self.last2('rate', var)
+        if last is None or last[1][0] == last[0][0]:
+            return 0
+        return float(last[1][1] - last[0][1]) / (last[1][0] - last[0][0])
+
+    @classmethod
+    def fromRule(cls, rule):
+        """Return an Aggregates tracking every aggregate function call found
+        in rule, or None if there are none.  Raise ValueError if a call is
+        not given a literal variable name and window size.
+
+        A rule which does not parse is left for rule evaluation to report.
+        """
+
+        try:
+            tree = ast.parse(rule.strip(), mode='eval')
+        except SyntaxError:
+            return None
+
+        aggs = cls()
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+                continue
+            func = node.func.id
+            if func not in WINDOWFUNCS and func not in SAMPLEFUNCS:
+                continue
+            args = [_literal(a) for a in node.args]
+            if func in ('max', 'min') and (len(args) != 2 or
+                                           not isinstance(args[0], string_types) or
+                                           not isinstance(args[1], (int, long))):
+                continue        # builtin max()/min()
+            if not args or not isinstance(args[0], string_types):
+                raise ValueError("%s() requires a variable name string as first argument"
+                                 % (func))
+            if func in SAMPLEFUNCS:
+                if len(args) != 1:
+                    raise ValueError("%s() takes only a variable name" % (func))
+                aggs.track(func, args[0])
+            else:
+                if len(args) != 2 or not isinstance(args[1], (int, long)) or args[1] < 1:
+                    raise ValueError("%s() requires a variable name and a window size > 0"
+                                     % (func))
+                aggs.track(func, args[0], args[1])
+
+        if not aggs:
+            return None
+        return aggs
+
+
+def _literal(node):
+    """Value of a string/number literal ast node, or None."""
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        return None
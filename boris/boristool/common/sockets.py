@@ -6,6 +6,7 @@ import select
 import traceback
 import errno
 
+from . import directive
 from . import log
 
 
@@ -72,14 +73,20 @@ def printState(Config, ccsock):
     shorthostname = shorthostname.replace('-', '_')
 
     for c in Config.groups:
-        if c.name == shorthostname or (c.name in
-                                       list(
-                                        Config.classDict.keys()) and
-                                       shorthostname in
-                                       Config.classDict[c.name]):
+        if c.name == shorthostname or shorthostname in Config.classDict.get(c.name, ()):
             printState(c, ccsock)
 
 
+def printCollectorStats(ccsock):
+    """Send the stats of each data collector (see DataModules.statsDump())."""
+
+    data_modules = getattr(directive, 'data_modules', None)
+    if data_modules is None:
+        return
+    for line in data_modules.statsDump():
+        ccsock.send(bytearray("collector %s\n" % (line), encoding='utf-8'))
+
+
 def listen(s, Config, die_event):
 
     while not die_event.isSet():
@@ -107,6 +114,7 @@ def listen(s, Config, die_event):
             ccsock.send(b'Boris Console Gateway\n')
 
             printState(Config, ccsock)
+            printCollectorStats(ccsock)
 
             ccsock.close()
 
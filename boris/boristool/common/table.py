@@ -0,0 +1,228 @@
+
+from __future__ import absolute_import
+
+import ast
+import fnmatch
+import itertools
+import operator
+
+from .. _compat import long, string_types
+
+# numpy is optional: columns are compared as arrays if it is available,
+# otherwise in a single list pass.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Comparison operators a vectorised rule may use
+COMPARE = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+NUMBER = (int, long, float)
+
+
+def isPattern(value):
+    """Return True if value is a wildcard pattern selecting table rows."""
+
+    return isinstance(value, string_types) and any(c in value for c in '*?[')
+
+
+def match(pattern, *names):
+    """Return True if any of names matches the (fnmatch) pattern."""
+
+    for name in names:
+        if name is not None and fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+class Table(object):
+    """Table mode state of a directive matching rows of a collector.
+
+    Shared between the table directive and each of its row directives
+    (see Directive.getRow()).
+    """
+
+    __slots__ = ('keyname', 'pattern', 'rows', 'rule', 'queued', 'requeueTime')
+
+    def __init__(self, keyname, pattern, rule=None):
+        self.keyname = keyname        # directive argument the pattern was given for
+        self.pattern = pattern        # wildcard pattern selecting rows
+        self.rows = {}                # row key -> row directive
+        self.rule = None              # TableRule, if the rule can be vectorised
+        if rule is not None:
+            self.rule = TableRule.fromRule(rule)
+        self.queued = 0               # rows which asked to be re-queued this check
+        self.requeueTime = None       # earliest requeueTime asked for by a row
+
+    def requeue(self, requeueTime):
+        """Called by a row directive instead of putting itself in the queue."""
+
+        self.queued = self.queued + 1
+        if requeueTime and (self.requeueTime is None or requeueTime < self.requeueTime):
+            self.requeueTime = requeueTime
+
+
+class TableRule(object):
+    """A directive rule made only of comparisons between variables and
+    constants, combined with and/or/not, eg:
+
+        rule='pctused > 90 and avail < 1000000'
+
+    Such a rule is evaluated for all rows of a table in one pass over
+    each column, rather than with an eval() per row.  Use fromRule() to
+    check a rule and build one.
+    """
+
+    __slots__ = ('tree',)
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    @classmethod
+    def fromRule(cls, rule):
+        """Return a TableRule for rule, or None if rule cannot be vectorised."""
+
+        try:
+            tree = ast.parse(rule.strip(), mode='eval').body
+        except (SyntaxError, AttributeError):
+            return None
+        if not _simple(tree):
+            return None
+        return cls(tree)
+
+    def evaluate(self, rows):
+        """Return a list of the rule results (True/False) for each of rows,
+        a list of variable mappings; or None if a row is missing a variable
+        or holds a value that cannot be compared.
+        """
+
+        try:
+            results = self._eval(self.tree, rows, {})
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not isinstance(results, (list, _ndarray)):
+            results = [results] * len(rows)        # constant rule
+        return [bool(r) for r in results]
+
+    def _eval(self, node, rows, columns):
+        if isinstance(node, ast.BoolOp):
+            values = [self._eval(v, rows, columns) for v in node.values]
+            return _combine(isinstance(node.op, ast.And), values, len(rows))
+
+        if isinstance(node, ast.UnaryOp):
+            value = self._eval(node.operand, rows, columns)
+            if isinstance(value, _ndarray):
+                return numpy.logical_not(value)
+            if isinstance(value, list):
+                return [not v for v in value]
+            return not value
+
+        if isinstance(node, ast.Compare):
+            left = self._operand(node.left, rows, columns)
+            values = []
+            for (op, comparator) in zip(node.ops, node.comparators):
+                right = self._operand(comparator, rows, columns)
+                values.append(_compare(COMPARE[type(op)], left, right, len(rows)))
+                left = right
+            if len(values) == 1:
+                return values[0]
+            return _combine(True, values, len(rows))
+
+        return ast.literal_eval(node)
+
+    def _operand(self, node, rows, columns):
+        if not isinstance(node, ast.Name) or node.id in ('True', 'False', 'None'):
+            return ast.literal_eval(node)
+        try:
+            return columns[node.id]
+        except KeyError:
+            pass
+        values = [row[node.id] for row in rows]
+        if numpy is not None and values and all(isinstance(v, NUMBER) for v in values):
+            values = numpy.array(values)
+        columns[node.id] = values
+        return values
+
+
+if numpy is not None:
+    _ndarray = numpy.ndarray
+else:
+    class _ndarray(object):
+        """Placeholder so isinstance() checks work without numpy."""
+
+
+def _simple(node):
+    """Return True if node only combines comparisons of names and constants."""
+
+    if isinstance(node, ast.BoolOp):
+        return all(_simple(v) for v in node.values)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, ast.Not) and _simple(node.operand)
+    if isinstance(node, ast.Compare):
+        for op in node.ops:
+            if type(op) not in COMPARE:
+                return False
+        return all(_simple_operand(o) for o in [node.left] + node.comparators)
+    return _constant(node)
+
+
+def _simple_operand(node):
+    return isinstance(node, ast.Name) or _constant(node)
+
+
+def _constant(node):
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        return False
+    return value is None or isinstance(value, NUMBER + string_types)
+
+
+def _column(value):
+    return isinstance(value, (list, _ndarray))
+
+
+def _compare(op, left, right, n):
+    """Compare two columns, or a column and a constant, row by row."""
+
+    if (isinstance(left, _ndarray) or isinstance(right, _ndarray)) and \
+            not isinstance(left, list) and not isinstance(right, list) and \
+            not isinstance(left, string_types) and not isinstance(right, string_types):
+        return op(left, right)
+
+    if not _column(left) and not _column(right):
+        return op(left, right)
+    if not _column(left):
+        left = itertools.repeat(left, n)
+    if not _column(right):
+        right = itertools.repeat(right, n)
+    return [op(l, r) for (l, r) in zip(left, right)]
+
+
+def _combine(conjunction, values, n):
+    """And (conjunction=True) or or together the row results in values."""
+
+    if all(isinstance(v, _ndarray) for v in values):
+        if conjunction:
+            return numpy.logical_and.reduce(values)
+        return numpy.logical_or.reduce(values)
+
+    rows = []
+    for v in values:
+        if isinstance(v, _ndarray):
+            v = v.tolist()
+        elif not isinstance(v, list):
+            v = [v] * n
+        rows.append(v)
+    if conjunction:
+        return [all(r) for r in zip(*rows)]
+    return [any(r) for r in zip(*rows)]
@@ -5,17 +5,20 @@ import threading
 import os
 import io
 import sys
+import time
 import smtplib
 import subprocess
 
-from .. _compat import PY2
+from .. _compat import PY2, lru_cache
 
 if PY2:
     import log
     from commands import getstatusoutput
+    from collections import Mapping
 else:
     from . import log
     from subprocess import getstatusoutput
+    from collections.abc import Mapping
 
 
 # Exceptions
@@ -59,6 +62,71 @@ class Stack(object):
             return self.stack[-1]
 
 
+class VarContext(Mapping):
+    """Layered, read-only view over a chain of variable dictionaries.
+
+    Lookups search the layers in the order given, so earlier layers take
+    precedence over later ones.  The layers themselves are never modified
+    or copied; any assignment is stored in a small local dictionary which
+    is searched before all layers.
+
+    eg: VarContext(defaults, data) behaves like a copy of data updated
+    with defaults, without building that copy.
+    """
+
+    def __init__(self, *layers):
+        self.local = {}                # variables assigned to this context
+        self.layers = [l for l in layers if l is not None]
+
+    def __getitem__(self, key):
+        try:
+            return self.local[key]
+        except KeyError:
+            pass
+        for layer in self.layers:
+            try:
+                return layer[key]
+            except KeyError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+
+    def __delitem__(self, key):
+        del self.local[key]
+
+    def __contains__(self, key):
+        if key in self.local:
+            return True
+        for layer in self.layers:
+            if key in layer:
+                return True
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for layer in [self.local] + self.layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return len(set(self.local).union(*self.layers))
+
+    def __repr__(self):
+        return "%s" % dict(self)
+
+    def new_child(self, layer=None):
+        """Return a new context with layer (or an empty local dictionary)
+        searched before this one.  The current context is not copied."""
+
+        if layer is None:
+            return VarContext(self)
+        return VarContext(layer, self)
+
+
 # Functions
 def tricky_split(line, delim):
     """tricky_split(line, delim) - split line by delimiter delim, but ignoring
@@ -197,6 +265,14 @@ def atom(ch):
     return mult
 
 
+def format_time(t):
+    """Format the epoch time t as 'YYYY/MM/DD H:MM:SS' local time, as
+    displayed on the console and in problem reports."""
+
+    t = time.localtime(t)
+    return "%04d/%02d/%02d %d:%02d:%02d" % (t[0], t[1], t[2], t[3], t[4], t[5])
+
+
 def val2secs(value):
     """
     Convert a time string to seconds.
@@ -502,6 +578,131 @@ def type_from_string(val):
                 return None
 
 
+# Size of the compiled message template caches
+TEMPLATE_CACHE_SIZE = 1024
+
+# %-format conversions: %(name)<flags><width><.precision><type> or %%
+_PERCENT = re.compile(r"%(?:\(([^()]*)\))?([-#0 +]*\d*(?:\.\d*)?[hlL]?)([diouxXeEfFgGcrsa%])")
+
+
+class PercentTemplate(object):
+    """A %-format string compiled into a list of segments, each a literal
+    string followed by the name and format of a variable (or None).
+
+    Only strings made of %(name)s style conversions are compiled; any
+    other (eg: '%s', '%*d' or an incomplete '%') is left to the %
+    operator, which raises the same exceptions as before.
+    """
+
+    __slots__ = ('text', 'segments', 'static')
+
+    def __init__(self, text):
+        self.text = text
+        self.segments = None          # [(literal, name, format)], or None if not compiled
+        self.static = None            # result text if there are no variables
+
+        segments = []
+        literal = []
+        pos = 0
+        for m in _PERCENT.finditer(text):
+            if text.find('%', pos, m.start()) >= 0:
+                return
+            literal.append(text[pos:m.start()])
+            pos = m.end()
+            (name, spec, conv) = m.groups()
+            if conv == '%':
+                if name is not None or spec:
+                    return
+                literal.append('%')
+                continue
+            if name is None:
+                return
+            spec = spec + conv
+            segments.append((''.join(literal), name, spec))
+            literal = []
+        rest = text[pos:]
+        if rest.find('%') >= 0:
+            return
+        literal.append(rest)
+        segments.append((''.join(literal), None, None))
+        if len(segments) == 1:
+            self.static = segments[0][0]
+        self.segments = segments
+
+    def substitute(self, var_dict):
+        """Return the text with the variables in var_dict substituted."""
+
+        if self.static is not None:
+            return self.static
+        if self.segments is None:
+            return self.text % var_dict
+        parts = []
+        for (literal, name, spec) in self.segments:
+            parts.append(literal)
+            if name is None:
+                break
+            value = var_dict[name]
+            if spec == 's':
+                parts.append(str(value))
+            else:
+                parts.append(('%' + spec) % (value,))
+        return ''.join(parts)
+
+
+class FormatTemplate(object):
+    """A str.format() string compiled into its literal text and fields,
+    formatted with TextTemplate.
+
+    Positional fields and nested format specs are left to
+    TextTemplate().format().
+    """
+
+    __slots__ = ('text', 'fields')
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = None            # [(literal, field, spec, conversion)], or None if not compiled
+        try:
+            fields = list(_formatter.parse(text))
+        except ValueError:
+            return
+        for (literal, field, spec, conversion) in fields:
+            if field is None:
+                continue
+            if field == '' or field[0].isdigit() or spec.find('{') >= 0:
+                return
+        self.fields = fields
+
+    def format(self, var_dict):
+        """Return the text formatted with the variables in var_dict."""
+
+        if self.fields is None:
+            return TextTemplate().format(self.text, **var_dict)
+        parts = []
+        for (literal, field, spec, conversion) in self.fields:
+            parts.append(literal)
+            if field is None:
+                continue
+            value = _formatter.get_field(field, (), var_dict)[0]
+            value = _formatter.convert_field(value, conversion)
+            parts.append(_formatter.format_field(value, spec))
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def percent_template(text):
+    """Return the (cached) PercentTemplate for text."""
+
+    return PercentTemplate(text)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def format_template(text):
+    """Return the (cached) FormatTemplate for text."""
+
+    return FormatTemplate(text)
+
+
 def parse_vars(text, var_dict):
     """
     Substitute variables in var_dict dictionary into text string.  Use
@@ -512,27 +713,64 @@ def parse_vars(text, var_dict):
       d["y"] = "x is '%(x)s'"
       d["z"] = "y is '%(y)s'"
       parse_vars("%(z)s", d) => "y is '%(y)s'" => "y is 'x is '%(x)s''" => "y is 'x is 'some string''"
+
+    Templates are compiled once (see percent_template()/format_template())
+    so only the substitution itself is done on each call.  A template
+    without variables needs a single pass, known when it is compiled.
     """
 
     # format & substitute variables using str.format with custom formatter
     if text.find('{') >= 0:
-        text = TextTemplate().format(text, **var_dict)
+        text = format_template(text).format(var_dict)
     # Keep parsing the text string until there are no '%(', or we've done a few parses...
     parses = 0
-    while (parses == 0 or text.find('%(') >= 0) and parses < 5:
+    while parses < 5:
         parses = parses + 1
+        template = percent_template(text)
         try:
-            text = text % var_dict
+            text = template.substitute(var_dict)
         except KeyError as msg:
             log.log("<utils>parse_vars(): KeyError exception for '%s' from string '%s' (%d) with dictionary '%s'" % (msg, text, parses, var_dict), 5)
             return text
         except TypeError as msg:
             log.log("<utils>parse_vars(): TypeError exception for '%s' from string '%s' (%d) with dictionary '%s'" % (msg, text, parses, var_dict), 5)
             return text
+        if template.static is not None or text.find('%(') < 0:
+            break
 
     return text
 
 
+def parse_vars_list(text, var_dicts):
+    """Return a list of text with the variables of each of var_dicts
+    substituted (see parse_vars()).  The template is compiled once for
+    all of them."""
+
+    if text.find('{') < 0:
+        template = percent_template(text)
+        if template.static is not None:
+            return [template.static] * len(var_dicts)
+    return [parse_vars(text, d) for d in var_dicts]
+
+
+def template_names(text):
+    """Return the set of variable names text refers to as %(name)s or
+    {name} (see parse_vars())."""
+
+    names = set()
+    for m in _PERCENT.finditer(text):
+        if m.group(1):
+            names.add(m.group(1))
+    if text.find('{') >= 0:
+        try:
+            for (literal, field, spec, conversion) in _formatter.parse(text):
+                if field:
+                    names.add(re.split(r'[.\[]', field)[0])
+        except ValueError:
+            pass
+    return names
+
+
 class TextTemplate(string.Formatter):
     """
     Template that supports custom str formats
@@ -545,6 +783,9 @@ class TextTemplate(string.Formatter):
         return super(TextTemplate, self).format_field(value, spec)
 
 
+_formatter = TextTemplate()
+
+
 def byte_convertor(n):
     """
     Convert bytes value to Kilo, Mega etc
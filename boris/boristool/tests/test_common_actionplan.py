@@ -0,0 +1,74 @@
+import unittest
+from . import env
+
+import boristool.common.action as action
+import boristool.common.actionplan as actionplan
+import boristool.common.config as config
+import boristool.common.definition as definition
+import boristool.common.log as log
+
+
+calls = []
+
+
+def record(self, *args):
+    """Test action plugin recording its arguments."""
+    calls.append(args)
+    return 0
+
+
+class ActionPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        del calls[:]
+        action.action.record = record
+        self.cfg = config.Config('__main__')
+        self.cfg.aliasDict['ADMIN'] = 'root@localhost'
+
+        msg = definition.MSG(['MSG', 'diskfull', ':'], None)
+        msg.tokenparser([['"disk full"', '"%(fs)s is full"']], None, 0)
+        m = definition.M(['M', 'disk', ':'], None)
+        m.give(msg)
+        self.cfg.MDict['disk'] = m
+        n = definition.N(['N', 'notify', ':'], None)
+        n.levels = {'0': ["record(ADMIN, diskfull), record('x' + 'y')"]}
+        self.cfg.NDict['notify'] = n
+        self.msg = msg
+
+    def tearDown(self):
+        del action.action.record
+
+    def test_call(self):
+        (step,) = actionplan.plan(self.cfg, ["record(ADMIN, 'hi', 3)"])
+        self.assertTrue(step.notif is None)
+        (call,) = step.calls
+        self.assertTrue(call.func is record)
+        self.assertEqual(call.args, ('root@localhost', 'hi', 3))
+        self.assertEqual(call(action.action()), 0)
+        self.assertEqual(calls, [('root@localhost', 'hi', 3)])
+
+    def test_notification(self):
+        (step,) = actionplan.plan(self.cfg, ["notify(disk)"])
+        self.assertEqual((step.notif, step.msg, step.level), ('notify', 'disk', '0'))
+        (first, second) = step.calls
+        self.assertTrue(first.func is record)
+        self.assertTrue(first.args[1] is self.msg)
+        # not resolvable to values, evaluated instead
+        self.assertTrue(second.func is None)
+        for c in step.calls:
+            c(action.action())
+        self.assertEqual(calls, [('root@localhost', self.msg), ('xy',)])
+
+    def test_cached(self):
+        (step,) = actionplan.plan(self.cfg, ["record(1)"])
+        self.assertTrue(actionplan.plan(self.cfg, ["record(1)"])[0] is step)
+
+    def test_undefined(self):
+        self.assertEqual(actionplan.plan(self.cfg, ["missing(disk)"]), [None])
+        (step,) = actionplan.plan(self.cfg, ["record(UNKNOWN, 'a')"])
+        self.assertTrue(step.calls[0].func is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,9 @@ from . import env
 
 import boristool.common.config as config
 import boristool.common.config
+import boristool.common.correlate
+import boristool.common.datacollect
+import boristool.common.directive
 import boristool.common.log as log
 import boristool.common.utils as utils
 
@@ -145,6 +148,44 @@ class ConfigOptionTest(unittest.TestCase):
             colist = ['NUMTHREADS', '=']
             co = config.NUMTHREADS(colist, typecolist)
 
+    def test_ruletimeout(self):
+        typecolist = 'RULETIMEOUT'
+        co = config.RULETIMEOUT(['RULETIMEOUT', '=', '0.5'], typecolist)
+        self.assertEqual(boristool.common.directive.RULETIMEOUT, 0.5)
+        co = config.RULETIMEOUT(['RULETIMEOUT', '=', 2, 'm'], typecolist)
+        self.assertEqual(boristool.common.directive.RULETIMEOUT, 120)
+        co = config.RULETIMEOUT(['RULETIMEOUT', '=', 0], typecolist)
+        self.assertEqual(boristool.common.directive.RULETIMEOUT, 0)
+        with self.assertRaises(config.ParseFailure):
+            colist = ['RULETIMEOUT', '=', 'X']
+            co = config.RULETIMEOUT(colist, typecolist)
+        with self.assertRaises(config.ParseFailure):
+            colist = ['RULETIMEOUT', '=', -1]
+            co = config.RULETIMEOUT(colist, typecolist)
+        with self.assertRaises(config.ParseFailure):
+            colist = ['RULETIMEOUT', '=']
+            co = config.RULETIMEOUT(colist, typecolist)
+
+    def test_correlatewindow(self):
+        typecolist = 'CORRELATEWINDOW'
+        co = config.CORRELATEWINDOW(['CORRELATEWINDOW', '=', 2, 'm'], typecolist)
+        self.assertEqual(boristool.common.correlate.WINDOW, 120)
+        co = config.CORRELATEWINDOW(['CORRELATEWINDOW', '=', 300], typecolist)
+        self.assertEqual(boristool.common.correlate.WINDOW, 300)
+        with self.assertRaises(config.ParseFailure):
+            colist = ['CORRELATEWINDOW', '=', 'X']
+            co = config.CORRELATEWINDOW(colist, typecolist)
+
+    def test_maxstale(self):
+        typecolist = 'MAXSTALE'
+        co = config.MAXSTALE(['MAXSTALE', '=', 30, 's'], typecolist)
+        self.assertEqual(boristool.common.datacollect.MAXSTALE, 30)
+        co = config.MAXSTALE(['MAXSTALE', '=', 0], typecolist)
+        self.assertEqual(boristool.common.datacollect.MAXSTALE, 0)
+        with self.assertRaises(config.ParseFailure):
+            colist = ['MAXSTALE', '=', 'X']
+            co = config.MAXSTALE(colist, typecolist)
+
     def test_console_port(self):
         colist = ['CONSOLE_PORT', '=', 5678]
         typecolist = 'CONSOLE_PORT'
@@ -0,0 +1,424 @@
+import threading
+import time
+import unittest
+from . import env
+
+import boristool.common.config as config
+import boristool.common.datacollect as datacollect
+import boristool.common.log as log
+import boristool.common.timequeue as timequeue
+from .test_common_directive import make_directive
+
+
+class TestCollector(datacollect.DataCollect):
+    """Collector counting its refreshes, which signals die_event on the first."""
+
+    def __init__(self, die_event):
+        super(TestCollector, self).__init__()
+        self.die_event = die_event
+        self.collected = 0
+
+    def collectData(self):
+        self.collected = self.collected + 1
+        self.data.datahash = {'x': self.collected}
+        self.die_event.set()
+
+
+class KeyCollector(datacollect.DataCollect):
+    """Collector counting full and single key refreshes."""
+
+    def __init__(self):
+        super(KeyCollector, self).__init__()
+        self.collected = 0
+        self.keys = []
+
+    def collectData(self):
+        self.collected = self.collected + 1
+        self.data.datahash = {'a': 1, 'b': 2}
+
+    def collectKey(self, key):
+        if key not in self.data.datahash:
+            return False
+        self.keys.append(key)
+        return True
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_read_only(self):
+        c = KeyCollector()
+        h = c.getHash()
+        self.assertEqual(dict(h), {'a': 1, 'b': 2})
+        with self.assertRaises(TypeError):
+            h['a'] = 3
+        self.assertRaises(AttributeError, setattr, c.snapshot, 'datahash', {})
+        self.assertEqual(sorted(c.hashKeys()), ['a', 'b'])
+        self.assertEqual(c['b'], 2)
+        self.assertRaises(KeyError, c.__getitem__, 'c')
+
+    def test_no_lock(self):
+        c = KeyCollector()
+        snapshot = c.getHash()
+        c.data_semaphore.acquire()        # readers of cached data do not wait
+        try:
+            self.assertTrue(c.getHash() is snapshot)
+        finally:
+            c.data_semaphore.release()
+
+        c.refresh()
+        self.assertFalse(c.getHash() is snapshot)
+        self.assertEqual(c.collected, 2)
+
+
+class HistoryTest(unittest.TestCase):
+
+    def snapshot(self, when, **datahash):
+        data = datacollect.Data()
+        data.datahash = datahash
+        data.count = len(datahash)
+        data.name = 'test'
+        return datacollect.Snapshot(data, when)
+
+    def test_columns(self):
+        h = datacollect.ColumnarHistory()
+        h.update(self.snapshot(0, a=1))
+        self.assertEqual(h.length(), 0)        # no history kept by default
+
+        h.setHistory(3)
+        for t in range(6):
+            h.update(self.snapshot(t * 60, a=t * 2, b='x'))
+        self.assertEqual(h.length(), 3)
+        self.assertEqual(sorted(h.series.keys()), ['a', 'count'])
+        self.assertEqual(list(h.values('a')), [4, 6, 8, 10])
+        self.assertEqual(h[0], {'a': 10, 'count': 2})
+        self.assertEqual(h[3]['a'], 4)
+        self.assertRaises(datacollect.IndexError, h.__getitem__, 4)
+
+        self.assertEqual(h.mean('a', 2), 9)
+        self.assertEqual(h.min('a'), 4)
+        self.assertEqual(h.max('a', 3), 10)
+        self.assertEqual(h.percentile('a', 50), 6)
+        self.assertAlmostEqual(h.slope('a'), 2 / 60.0)
+
+        h.setHistory(5)                        # growing keeps the values
+        self.assertEqual(list(h.values('a')), [4, 6, 8, 10])
+        h.update(self.snapshot(360, a=12))
+        self.assertEqual(list(h.values('a')), [4, 6, 8, 10, 12])
+        self.assertEqual(h[0]['a'], 12)
+
+    def test_objects(self):
+        class Mount(object):
+            def getHash(self):
+                return {'pctused': 50, 'fstype': 'ext4'}
+
+        h = datacollect.ColumnarHistory()
+        h.setHistory(1)
+        h.update(self.snapshot(0, root=Mount()))
+        self.assertEqual(h[0], {'root.pctused': 50, 'count': 1})
+
+
+class SlowCollector(datacollect.DataCollect):
+    """Collector whose collectData() waits for the test to release it."""
+
+    def __init__(self):
+        super(SlowCollector, self).__init__()
+        self.collected = 0
+        self.release = threading.Event()
+
+    def collectData(self):
+        self.release.wait()
+        self.collected = self.collected + 1
+        self.data.datahash = {'x': self.collected}
+
+
+class FlightTest(unittest.TestCase):
+
+    def read(self, c, results):
+        results.append(c['x'])
+
+    def test_single_flight(self):
+        c = SlowCollector()
+        results = []
+        threads = [threading.Thread(target=self.read, args=(c, results)) for i in range(5)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        c.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(c.collected, 1)
+        self.assertEqual(results, [1] * 5)
+
+    def test_stale_while_revalidate(self):
+        c = SlowCollector()
+        c.release.set()
+        self.assertEqual(c['x'], 1)
+        c.maxstale = 60
+        c.release.clear()
+        c.refresh_time = time.time() - 1
+        self.assertEqual(c['x'], 1)        # stale data, refreshing in the background
+        self.assertEqual(c['x'], 1)
+        flight = c.flight
+        c.release.set()
+        flight.wait(5)
+        self.assertEqual(c['x'], 2)
+        self.assertEqual(c.collected, 2)
+
+        # too stale, wait for the refresh
+        c.refresh_time = time.time() - 61
+        self.assertEqual(c['x'], 3)
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_counts(self):
+        c = KeyCollector()
+        c.getHash()
+        c.getHash()
+        c.refresh_time = 0
+        c['a']
+
+        def fail():
+            raise datacollect.DataFailure('test')
+        c.collectData = fail
+        c.refresh()
+
+        stats = c.stats
+        self.assertEqual((stats.refreshes, stats.failures), (3, 1))
+        self.assertEqual((stats.hits, stats.stale, stats.misses), (2, 0, 1))
+        self.assertEqual(sum(stats.histogram), 3)
+        self.assertAlmostEqual(stats.hitRatio(), 2 / 3.0)
+        self.assertTrue(str(stats).startswith('refreshes 3 failures 1 '))
+
+    def test_wait(self):
+        c = SlowCollector()
+        c.refresh()
+        t = threading.Thread(target=c.refresh)
+        t.start()
+        time.sleep(0.05)
+        c.refresh()
+        t.join()
+        self.assertEqual(c.stats.waits, 1)
+        self.assertTrue(c.stats.wait_max > 0)
+
+    def test_dump(self):
+        modules = datacollect.DataModules('Linux', '6.1', 'x86_64')
+        ref = modules.request('df', 'dfList')
+        self.assertEqual(modules.statsDump(), [])        # not created yet
+        ref.stats.refreshed(0.2)
+        self.assertEqual(modules.statsDump()[0].split(':')[0], 'df.dfList')
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+
+    def test_lazy(self):
+        modules = datacollect.DataModules('Linux', '6.1', 'x86_64')
+        d = make_directive(self.cfg, 'r1', [('rule', '"x"')])
+        ref = modules.request('df', 'dfList', d)
+        self.assertTrue(modules.request('df', 'dfList') is ref)
+        self.assertEqual(list(modules.collectors.keys()), [('df', 'dfList')])
+        self.assertTrue(ref.collector is None)        # not created until used
+        self.assertEqual(ref.refresh_rate, 55)
+        self.assertTrue(isinstance(ref.collector, ref.cls))
+        self.assertEqual(ref.cls.__module__, 'boristool.arch.Linux.df')
+        self.assertTrue(ref.collector.consumers is ref.consumers)
+        self.assertEqual(ref.consumers, [d])
+
+    def test_cached_module(self):
+        modules = datacollect.DataModules('Linux', '6.1', 'x86_64')
+        self.assertRaises(datacollect.DataModuleError, modules.request, 'nosuchmodule', 'x')
+        self.assertEqual(modules.modules, {'nosuchmodule': None})
+        self.assertRaises(datacollect.DataModuleError, modules.request, 'df', 'nosuchcollector')
+        self.assertEqual(sorted(modules.modules.keys()), ['df', 'nosuchmodule'])
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+
+    def test_align(self):
+        c = KeyCollector()
+        c.align()
+        self.assertEqual(c.refresh_rate, 55)
+        for (ID, period) in (('a1', 60), ('a2', 10)):
+            d = make_directive(self.cfg, ID, [('rule', '"x"')])
+            d.scanperiod = period
+            c.consumers.append(d)
+        c.align()
+        self.assertEqual(c.refresh_rate, 9)
+
+    def test_prefetch(self):
+        die_event = threading.Event()
+        c = KeyCollector()
+        c.refresh_rate = 1
+
+        def collectData():
+            KeyCollector.collectData(c)
+            if c.collected == 2:
+                die_event.set()
+        c.collectData = collectData
+        c.prefetcher(die_event)
+        self.assertEqual(c.collected, 2)
+        self.assertTrue(c.refresh_time > time.time())        # refreshed before it expired
+
+
+class CostCollector(datacollect.DataCollect):
+    """Collector with a cheap and an expensive field."""
+
+    costs = {'cheap': 1, 'users': 10}
+
+    def __init__(self):
+        super(CostCollector, self).__init__()
+        self.collected = []
+
+    def collectData(self):
+        self.data.datahash = {}
+        for f in ('cheap', 'users'):
+            if self.needs(self.data.datahash, f):
+                self.collected.append(f)
+                self.data.datahash[f] = self.refreshes
+
+
+class FieldsTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+
+    def test_directive_fields(self):
+        d = make_directive(self.cfg, 'f1', [('rule', '"cheap > 1 and len(x) < 2"'),
+                                            ('action', '["email(\'root\', \'{cheap} %(y)s\')"]')])
+        self.assertEqual(d.fields(), set(['cheap', 'len', 'x', 'y']))
+        d = make_directive(self.cfg, 'f2', [('action', '"x"')])
+        self.assertEqual(d.fields(), None)
+
+    def test_skip(self):
+        c = CostCollector()
+        c.refresh()
+        self.assertEqual(c.collected, ['cheap', 'users'])        # all fields until aligned
+
+        c.consumers.append(make_directive(self.cfg, 'f3', [('rule', '"cheap > 1"')]))
+        c.alignFields()
+        c.collected = []
+        c.refresh()
+        self.assertEqual(c.collected, ['cheap'])
+        self.assertEqual(dict(c.getHash()), {'cheap': 2})
+
+    def test_sample(self):
+        c = CostCollector()
+        c.sample_refreshes = 3
+        collected = []
+        for i in range(5):
+            c.refresh()
+            collected.append(c.collected.count('users'))
+            self.assertEqual(c['cheap'], i + 1)
+        self.assertEqual(collected, [1, 1, 1, 2, 2])
+        self.assertEqual(c['users'], 4)        # kept until sampled again
+
+
+class CounterCollector(datacollect.DataCollect):
+    """Collector returning the next of a list of counter values."""
+
+    counters = ('ctr',)
+
+    def __init__(self, values):
+        super(CounterCollector, self).__init__()
+        self.values = list(values)
+
+    def collectData(self):
+        self.data.datahash = {'ctr': self.values.pop(0), 'other': 1}
+
+
+class CounterTest(unittest.TestCase):
+
+    def test_rates(self):
+        c = CounterCollector([100, 160, 2 ** 32 - 10, 20, 5])
+        now = time.time()
+        deltas = []
+        for i in range(5):
+            c.refresh()
+            deltas.append(c['ctr_delta'])
+            self.assertEqual(c['ctr'], c.counter_values[(None, 'ctr')][1])
+        self.assertEqual(deltas, [0, 60, 2 ** 32 - 170, 30, 5])        # wrapped, then reset
+        self.assertFalse('other_rate' in c.getHash())
+        self.assertEqual(c.counter_values.keys(), set([(None, 'ctr')]))
+
+        c.counter_values[(None, 'ctr')] = (now - 10, 0)
+        c.values = [50]
+        c.refresh()
+        self.assertAlmostEqual(c['ctr_rate'], 5.0, 1)
+
+    def test_delta(self):
+        self.assertEqual(datacollect._counterDelta(2 ** 64 - 1, 1), 2)
+        self.assertEqual(datacollect._counterDelta(2 ** 40, 3), 3)
+        self.assertEqual(datacollect._counterDelta(7, 7), 0)
+
+
+class RecheckTest(unittest.TestCase):
+
+    def test_recheck(self):
+        c = KeyCollector()
+        c.recheck('a')
+        self.assertEqual(c.collected, 1)        # nothing collected yet, full refresh
+        c.recheck('a')
+        c.recheck()
+        self.assertEqual(c.collected, 1)        # collapsed within recheck_rate
+        self.assertEqual(c.keys, [])
+
+        c.last_refresh = c.last_refresh - c.recheck_rate
+        c.recheck('a')
+        c.recheck('a')
+        self.assertEqual(c.keys, ['a'])
+        c.recheck('b')
+        self.assertEqual(c.keys, ['a', 'b'])
+        c.recheck('c')                          # unknown key, full refresh
+        self.assertEqual(c.collected, 2)
+        self.assertEqual(c.key_refresh, {})
+
+
+class PublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+
+    def test_publish(self):
+        die_event = threading.Event()
+        c = TestCollector(die_event)
+        d = make_directive(self.cfg, 'push1', [('rule', '"x > 0"'), ('push', '"on"')])
+        self.assertTrue(d.triggered)
+        c.subscribe(d)
+        c.subscribe(d)
+        self.assertEqual(c.subscribers, [d])
+        self.assertEqual(c.publish_period(), d.scanperiod)
+
+        d.pending = False
+        c.publisher(self.cfg, die_event)
+        self.assertEqual(c.collected, 1)
+        self.assertEqual(self.cfg.q.qsize(), 1)
+        self.assertTrue(self.cfg.q.get()[0] is d)
+
+        # checked from the published data, then waits for the next publish
+        d.testdata = c.getHash()
+        d.docheck(self.cfg)
+        self.assertEqual(c.collected, 1)
+        self.assertEqual(d.state.status, 'fail')
+        self.assertEqual(self.cfg.q.qsize(), 0)
+        d.trigger(self.cfg)
+        d.trigger(self.cfg)
+        self.assertEqual(self.cfg.q.qsize(), 1)
+
+    def test_bad_push(self):
+        self.assertRaises(config.directive.ParseFailure, make_directive, self.cfg, 'push2',
+                          [('rule', '"x > 0"'), ('push', '"maybe"')])
+
+
+if __name__ == '__main__':
+    unittest.main()
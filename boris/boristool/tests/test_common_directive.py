@@ -0,0 +1,405 @@
+import time
+import unittest
+from . import env
+
+import boristool.common.config as config
+import boristool.common.correlate as correlate
+import boristool.common.directive as directive
+import boristool.common.directives.common as directives
+import boristool.common.log as log
+import boristool.common.timequeue as timequeue
+
+
+class TESTDIR(directive.Directive):
+    """Directive evaluating its rule against self.testdata."""
+
+    __slots__ = ('testdata',)
+
+    def tokenparser(self, toklist, toktypes, indent):
+        super(TESTDIR, self).tokenparser(toklist, toktypes, indent)
+        self.state.ID = self.ID
+
+    def getData(self):
+        return self.testdata
+
+
+class TESTTABLE(TESTDIR):
+    """Directive checking the rows of self.testdata matching its name argument."""
+
+    __slots__ = ()
+
+    def tokenparser(self, toklist, toktypes, indent):
+        super(TESTTABLE, self).tokenparser(toklist, toktypes, indent)
+        self.setTable('name', self.args.name)
+
+    def getTable(self):
+        return self.testdata
+
+
+config.directives['TESTDIR'] = TESTDIR
+config.directives['TESTTABLE'] = TESTTABLE
+config.directives['DERIVED'] = directives.DERIVED
+
+
+def make_directive(cfg, ID, args, cls=TESTDIR):
+    """Create a directive the same way parseconfig does."""
+
+    d = cls([cls.__name__, ID, ':'])
+    d.Config = cfg
+    d.scanperiod = 60
+    cfg.give(d)
+    d.tokenparser([[k, '=', v] for (k, v) in args], None, 0)
+    return d
+
+
+class ArgsTest(unittest.TestCase):
+
+    def test_attributes(self):
+        args = directive.Args()
+        args.rule = 'x > 1'
+        self.assertEqual(args.rule, 'x > 1')
+        self.assertTrue(hasattr(args, 'rule'))
+        self.assertFalse(hasattr(args, 'action'))
+        self.assertEqual(dir(args), ['rule'])
+        del args.rule
+        with self.assertRaises(AttributeError):
+            args.rule
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(directive.Args(), '__dict__'))
+
+    def test_parent(self):
+        parent = directive.Args()
+        parent.rule = 'x > 1'
+        parent.scanperiod = 60
+        args = directive.Args(parent=parent)
+        args.scanperiod = 30
+        self.assertEqual(args.rule, 'x > 1')
+        self.assertEqual(args.scanperiod, 30)
+        self.assertEqual(parent.scanperiod, 60)
+        self.assertEqual(dir(args), ['rule', 'scanperiod'])
+        self.assertFalse(hasattr(args, 'action'))
+
+
+class RuleTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+
+    def test_eval_rule(self):
+        self.assertEqual(directive.evalRule('x + 1', {'x': 1}, 0), 2)
+        self.assertEqual(directive.evalRule('x + 1', {'x': 1}, 1), 2)
+        self.assertRaises(directive.RuleTimeout, directive.evalRule,
+                          'len([i for i in range(n) if i > -1])', {'n': 10**9}, 0.05)
+
+    def test_timeout_unknown(self):
+        d = make_directive(self.cfg, 'slow1', [('rule', '"len([i for i in range(n) if i > -1])"'),
+                                               ('ruletimeout', '0.05')])
+        d.testdata = {'n': 10**9}
+        d.docheck(self.cfg)
+        self.assertEqual(d.state.status, 'unknown')
+        self.assertEqual(d.ruletimeouts, 1)
+        (queued, when) = self.cfg.q.get()
+        self.assertTrue(queued is d)
+        self.assertTrue(when > time.time() + d.scanperiod)
+
+        # a successful evaluation resets the backoff
+        d.testdata = {'n': 1}
+        d.docheck(self.cfg)
+        self.assertEqual(d.ruletimeouts, 0)
+        self.assertEqual(d.state.status, 'fail')
+
+
+class AggregateRuleTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+
+    def test_avg_rule(self):
+        d = make_directive(self.cfg, 'agg1', [('rule', '"avg(\'x\', 3) > 5"')])
+        for (x, status) in ((9, 'fail'), (1, 'ok'), (1, 'ok'), (20, 'fail')):
+            d.testdata = {'x': x}
+            d.docheck(self.cfg)
+            self.assertEqual(d.state.status, status)
+        self.assertFalse('avg' in d.Action.varDict)
+
+    def test_bad_aggregate(self):
+        self.assertRaises(directive.ParseFailure, make_directive,
+                          self.cfg, 'agg2', [('rule', '"avg(x, 3) > 5"')])
+
+
+class TableTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+
+    def check(self, rule):
+        d = make_directive(self.cfg, 'table1', [('name', '"*"'), ('rule', rule)], TESTTABLE)
+        d.testdata = {'a': {'x': 1}, 'b': {'x': 5}}
+        d.docheck(self.cfg)
+        self.assertEqual(d.state.status, 'fail')
+        self.assertEqual(sorted(d.table.rows.keys()), ['a', 'b'])
+        self.assertEqual(d.table.rows['a'].state.status, 'ok')
+        self.assertEqual(d.table.rows['b'].state.status, 'fail')
+        self.assertEqual(d.table.rows['b'].ID, 'table1[b]')
+        self.assertEqual(d.table.rows['b'].Action.varDict['name'], 'b')
+        self.assertEqual(self.cfg.q.qsize(), 1)
+        self.assertTrue(self.cfg.q.get()[0] is d)
+
+        # rows which disappear are forgotten
+        d.testdata = {'a': {'x': 1}}
+        d.docheck(self.cfg)
+        self.assertEqual(d.state.status, 'ok')
+        self.assertEqual(list(d.table.rows.keys()), ['a'])
+        return d
+
+    def test_vectorised(self):
+        d = self.check('"x > 2"')
+        self.assertTrue(d.table.rule is not None)
+
+    def test_per_row(self):
+        d = self.check('"x + 0 > 2"')
+        self.assertTrue(d.table.rule is None)
+
+    def test_not_table(self):
+        d = make_directive(self.cfg, 'table2', [('name', '"a"'), ('rule', '"x > 2"')], TESTTABLE)
+        self.assertTrue(d.table is None)
+
+
+class DerivedTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+
+    def test_derived(self):
+        web = make_directive(self.cfg, 'web', [('rule', '"up == 0"')])
+        load = make_directive(self.cfg, 'load', [('rule', '"loadavg1 > 10"')])
+        d = make_directive(self.cfg, 'both', [('inputs', '"w=web, l=load"'),
+                                              ('rule', '"w.status != \'ok\' and l.loadavg1 > 5"')],
+                           directives.DERIVED)
+        self.assertEqual(web.dependents, (d,))
+        self.assertEqual(load.dependents, (d,))
+
+        # waits for all inputs, and is not re-queued on scanperiod
+        d.pending = False
+        d.docheck(self.cfg)
+        self.assertEqual(d.state.status, 'unknown')
+        self.assertEqual(self.cfg.q.qsize(), 0)
+
+        web.testdata = {'up': 0}
+        web.docheck(self.cfg)
+        load.testdata = {'loadavg1': 7}
+        load.docheck(self.cfg)
+
+        # triggered once by its inputs
+        queued = [self.cfg.q.get()[0] for i in range(self.cfg.q.qsize())]
+        self.assertEqual(queued.count(d), 1)
+        self.assertEqual(queued.count(web), 1)
+        self.assertEqual(queued.count(load), 1)
+
+        d.docheck(self.cfg)
+        self.assertEqual(d.state.status, 'fail')
+        self.assertEqual(self.cfg.q.qsize(), 0)
+
+    def test_input_not_found(self):
+        self.assertRaises(directive.ParseFailure, make_directive, self.cfg, 'bad',
+                          [('inputs', '"w=missing"'), ('rule', '"True"')], directives.DERIVED)
+
+
+class CorrelateTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+        correlate.correlator = correlate.Correlator()
+
+    def make(self, ID, correlate='"switch1"'):
+        d = make_directive(self.cfg, ID, [('rule', '"x > 1"'), ('action', '"noaction()"'),
+                                          ('correlate', correlate)])
+        d.testdata = {'x': 2}
+        return d
+
+    def test_key(self):
+        self.assertEqual(self.make('key1').correlatekey, 'switch1')
+        self.assertEqual(self.make('key2', '"host"').correlatekey, 'host:testhost')
+        self.assertEqual(self.make('key3', '"group"').correlatekey, 'group:__main__')
+        self.assertTrue(make_directive(self.cfg, 'key4', [('rule', '"x"')]).correlatekey is None)
+
+    def test_incident(self):
+        root = self.make('port1')
+        deps = [self.make('port%d' % i) for i in (2, 3)]
+        for d in [root] + deps:
+            d.docheck(self.cfg)
+        self.assertEqual(root.performedactions, 1)
+        self.assertEqual([d.performedactions for d in deps], [0, 0])
+        incident = correlate.correlator.incidents['switch1']
+        self.assertTrue(incident.root is root)
+        self.assertEqual(incident.members, deps)
+
+        # repeated root actions report the incident
+        root.current_actionperiod = 0
+        root.docheck(self.cfg)
+        self.assertTrue(root.Action.varDict['incident'].startswith('switch1: root port1, 2 correlated'))
+
+        # the next failure after the root recovers starts a new incident
+        root.testdata = {'x': 0}
+        root.docheck(self.cfg)
+        self.assertFalse('switch1' in correlate.correlator.incidents)
+        deps[0].docheck(self.cfg)
+        self.assertEqual(deps[0].performedactions, 1)
+        self.assertTrue(correlate.correlator.incidents['switch1'].root is deps[0])
+
+    def test_window(self):
+        root = self.make('port4')
+        late = self.make('port5')
+        root.docheck(self.cfg)
+        late.state.status = 'fail'
+        late.state.faildetecttime = root.state.faildetecttime + correlate.WINDOW + 1
+        self.assertFalse(correlate.correlator.suppress(late))
+        self.assertEqual(correlate.correlator.incidents['switch1'].members, [])
+
+
+class FlapTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+
+    def test_flapping(self):
+        d = make_directive(self.cfg, 'flap1', [('rule', '"x > 1"'), ('flapthreshold', '4'),
+                                               ('action', '"noaction()"'), ('actflap', '"noaction()"')])
+        for x in (2, 0, 2, 0):
+            d.testdata = {'x': x}
+            d.docheck(self.cfg)
+        self.assertFalse(d.state.flapping)
+        d.testdata = {'x': 2}
+        d.docheck(self.cfg)
+        self.assertTrue(d.state.flapping)
+        self.assertEqual(d.Action.varDict['flapping'],
+                         'flap1 is flapping: 4 status changes in the last 20 checks')
+        self.assertEqual(d.console_str('%(state)s %(flapping)s'), 'fail flapping')
+
+        # actions are suppressed while flapping
+        d.performedactions = 0
+        for x in (0, 2, 0, 2):
+            d.testdata = {'x': x}
+            d.docheck(self.cfg)
+            self.assertFalse('flapping' in d.Action.varDict)
+        self.assertEqual(d.performedactions, 0)
+
+        # and it settles once the changes drop to half the threshold
+        d.testdata = {'x': 2}
+        for i in range(directive.FLAPWINDOW):
+            d.docheck(self.cfg)
+            if not d.state.flapping:
+                break
+        self.assertFalse(d.state.flapping)
+        self.assertEqual(bin(d.state.transitions).count('1'), 2)
+
+    def test_bad_threshold(self):
+        self.assertRaises(directive.ParseFailure, make_directive, self.cfg, 'flap2',
+                          [('rule', '"x > 1"'), ('flapthreshold', '100')])
+
+
+class LookupTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.routers = self.cfg.newgroup(['group', 'routers', ':'], [None, 'NAME'], self.cfg)
+        self.router1 = self.routers.newgroup(['group', 'router1', ':'], [None, 'NAME'], self.routers)
+        self.top = make_directive(self.cfg, 'top', [('rule', '"x"')])
+        self.ping = make_directive(self.router1, 'router_ping', [('rule', '"x"')])
+
+    def test_find(self):
+        d = self.ping
+        self.assertTrue(d.findDirective('top', self.router1) is self.top)
+        self.assertTrue(d.findDirective('routers.router1.router_ping', self.cfg) is d)
+        self.assertTrue(d.findDirective('router1.router_ping', self.cfg) is None)
+        self.assertTrue(d.findDirective('routers.missing.router_ping', self.cfg) is None)
+        self.assertTrue(d.findDirective('missing', self.cfg) is None)
+
+    def test_merge_group(self):
+        self.assertTrue(self.cfg.newgroup(['group', 'routers', ':'], [None, 'NAME'], self.cfg)
+                        is self.routers)
+        self.assertEqual(self.cfg.groups, [self.routers])
+
+
+class TemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+        self.assertRaises(directive.TemplateDirective, make_directive,
+                          self.cfg, 'tpl', [('template', 'self'), ('rule', '"x > 1"'),
+                                            ('action', '"email"'), ('scanperiod', '"5m"')])
+
+    def test_shared_args(self):
+        d1 = make_directive(self.cfg, 'child1', [('template', 'tpl')])
+        d2 = make_directive(self.cfg, 'child2', [('template', 'tpl'), ('rule', '"x > 2"')])
+        tplargs = self.cfg.templateCache['tpl']
+        self.assertTrue(d1.args._parent is tplargs)
+        self.assertTrue(d2.args._parent is tplargs)
+        self.assertEqual(d1.args.rule, 'x > 1')
+        self.assertEqual(d2.args.rule, 'x > 2')
+        self.assertEqual(d1.args.scanperiod, 300)
+        self.assertEqual(d1.args.template, 'tpl')
+        self.assertFalse('rule' in d1.args._values)
+
+    def test_template_not_found(self):
+        self.assertRaises(directive.ParseFailure, make_directive,
+                          self.cfg, 'child3', [('template', 'missing')])
+
+
+class StateTest(unittest.TestCase):
+
+    def setUp(self):
+        log.hostname = 'testhost'
+        self.cfg = config.Config('__main__')
+        self.cfg.q = timequeue.TimeQueue(0)
+
+    def test_epoch_times(self):
+        d = make_directive(self.cfg, 'state1', [('rule', '"x > 1"')])
+        d.testdata = {'x': 2}
+        d.docheck(self.cfg)
+        self.assertEqual(d.state.status, 'fail')
+        self.assertTrue(isinstance(d.state.faildetecttime, float))
+        self.assertEqual(d.state.age()[5], 0)
+        self.assertTrue(d.console_str('%(problemfirstdetect)s').startswith('First detected: '))
+
+    def test_slots(self):
+        d = make_directive(self.cfg, 'state2', [('rule', '"x > 1"')])
+        self.assertFalse(hasattr(d, '__dict__'))
+        self.assertFalse(hasattr(d.state, '__dict__'))
+        self.assertFalse(hasattr(d.state.ack, '__dict__'))
+
+    def test_interned_id(self):
+        d = make_directive(self.cfg, 'state3', [('rule', '"x > 1"')])
+        self.assertTrue(d.ID is directive.intern(''.join(['state', '3'])))
+
+
+    def test_history_fields(self):
+        d = make_directive(self.cfg, 'state4', [('rule', '"history[1].x < x"'), ('history', '2')])
+        self.assertEqual(d.history.keep, frozenset(['x']))
+        d = make_directive(self.cfg, 'state5', [('rule', '"x > 1"'), ('history', '2'),
+                                                ('historyfields', '"x, y"')])
+        self.assertEqual(d.history.keep, frozenset(['x', 'y']))
+        d.testdata = {'x': 0, 'y': 1, 'z': 2}
+        d.docheck(self.cfg)
+        self.assertEqual(d.history[1].getHash(), {'x': 0, 'y': 1})
+        self.assertEqual(int(d.console_str('%(historybytes)s')), d.history.memory())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+from . import env
+
+import boristool.common.history as history
+
+
+class HistoryTest(unittest.TestCase):
+
+    def test_ring(self):
+        h = history.History(3)
+        self.assertRaises(IndexError, h.__getitem__, 1)
+        for i in range(5):
+            h.push({'x': i, 'load': i / 2.0, 'name': 'n%d' % i})
+        self.assertEqual(h.getsize(), 3)
+        self.assertEqual([h[i].x for i in (1, 2, 3)], [4, 3, 2])
+        self.assertEqual(h[2].load, 1.5)
+        self.assertEqual(h[3].name, 'n2')
+        self.assertTrue(h[4] is None)
+        self.assertEqual(h[1].getHash(), {'x': 4, 'load': 2.0, 'name': 'n4'})
+        self.assertEqual(h.columns['x'].values.typecode, 'q')
+        self.assertEqual(h.columns['load'].values.typecode, 'd')
+        self.assertTrue(h.fields[0] is h.fields[1])
+
+    def test_types_and_fields(self):
+        h = history.History(2)
+        h.push({'x': 1})
+        h.push({'x': 'n/a', 'y': True})
+        self.assertEqual(h[1].x, 'n/a')
+        self.assertEqual(h[2].x, 1)
+        self.assertTrue(h[1].y is True)
+        self.assertRaises(AttributeError, getattr, h[2], 'y')
+
+    def test_overwritten(self):
+        h = history.History(2)
+        h.push({'x': 1})
+        h.push({'x': 2})
+        oldest = h[2]
+        h.push({'x': 3})
+        self.assertRaises(IndexError, getattr, oldest, 'x')
+
+
+    def test_keep(self):
+        big = dict([('v%d' % i, 'x' * 100) for i in range(50)])
+        full = history.History(5)
+        kept = history.History(5, frozenset(['x', 'missing']))
+        for i in range(5):
+            big['x'] = i
+            full.push(big)
+            kept.push(big)
+        self.assertEqual(kept[1].getHash(), {'x': 4})
+        self.assertEqual(sorted(kept.columns.keys()), ['x'])
+        self.assertRaises(AttributeError, getattr, kept[1], 'v1')
+        self.assertTrue(kept.memory() * 10 < full.memory())
+
+    def test_fields_from_rule(self):
+        self.assertEqual(history.fieldsFromRule('history[1].x < x and history[2].y > 1'),
+                         frozenset(['x', 'y']))
+        self.assertEqual(history.fieldsFromRule('x > 1'), frozenset())
+        self.assertEqual(history.fieldsFromRule('history[1].getHash()["x"] > 1'), None)
+        self.assertEqual(history.fieldsFromRule('len(history) > 1'), None)
+        self.assertEqual(history.fieldsFromRule('x >'), None)
+
+
+class WindowTest(unittest.TestCase):
+
+    def test_aggregates(self):
+        w = history.Window(3, ordered=True)
+        samples = [5, 1, 4, 9, 2, 6]
+        for (i, v) in enumerate(samples):
+            w.push(v)
+            window = samples[max(0, i - 2):i + 1]
+            self.assertEqual(list(w.values), window)
+            self.assertEqual(w.avg(), float(sum(window)) / len(window))
+            self.assertEqual(w.max(), max(window))
+            self.assertEqual(w.min(), min(window))
+            self.assertEqual(w.ordered, sorted(window))
+        self.assertEqual(w.percentile(95), 9)
+        self.assertEqual(w.percentile(50), 6)
+
+
+class AggregatesTest(unittest.TestCase):
+
+    def test_from_rule(self):
+        aggs = history.Aggregates.fromRule('avg("load", 5) > 4 or p95("load", 5) > 8 or rate("ctxt") > 10')
+        self.assertEqual(sorted(aggs.windows.keys()), [('load', 5)])
+        self.assertTrue(aggs.windows[('load', 5)].ordered is not None)
+        self.assertEqual(list(aggs.samples.keys()), ['ctxt'])
+
+    def test_from_rule_none(self):
+        self.assertTrue(history.Aggregates.fromRule('load > 4') is None)
+        self.assertTrue(history.Aggregates.fromRule('max(a, b) > 4') is None)
+        self.assertTrue(history.Aggregates.fromRule('load >') is None)
+
+    def test_from_rule_errors(self):
+        self.assertRaises(ValueError, history.Aggregates.fromRule, 'avg(load, 5) > 4')
+        self.assertRaises(ValueError, history.Aggregates.fromRule, 'avg("load") > 4')
+        self.assertRaises(ValueError, history.Aggregates.fromRule, 'rate("ctxt", 5) > 4')
+
+    def test_functions(self):
+        aggs = history.Aggregates.fromRule('max("x", 2) > min("x", 3) or delta("y") > rate("y")')
+        f = aggs.functions
+        aggs.update({'x': 3, 'y': 100}, now=10)
+        self.assertEqual(f['delta']('y'), 0)
+        self.assertEqual(f['rate']('y'), 0)
+        aggs.update({'x': 1, 'y': 130}, now=20)
+        aggs.update({'x': 2, 'y': 'n/a'}, now=30)
+        self.assertEqual(f['max']('x', 2), 2)
+        self.assertEqual(f['min']('x', 3), 1)
+        self.assertEqual(f['delta']('y'), 30)
+        self.assertEqual(f['rate']('y'), 3.0)
+        # builtin behaviour is kept for other uses
+        self.assertEqual(f['max'](1, 7), 7)
+        self.assertEqual(f['min']([4, 2]), 2)
+        self.assertRaises(NameError, f['avg'], 'x', 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
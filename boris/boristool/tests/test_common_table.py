@@ -0,0 +1,59 @@
+import unittest
+from . import env
+
+import boristool.common.table as table
+
+
+ROWS = [
+    {'name': '/', 'pctused': 50.0, 'avail': 900},
+    {'name': '/var', 'pctused': 95.0, 'avail': 100},
+    {'name': '/home', 'pctused': 91.0, 'avail': 5000},
+]
+
+
+class TableRuleTest(unittest.TestCase):
+
+    def evaluate(self, rule, rows=ROWS):
+        tr = table.TableRule.fromRule(rule)
+        self.assertTrue(tr is not None)
+        results = tr.evaluate(rows)
+        self.assertEqual(results, [bool(eval(rule, {}, row)) for row in rows])
+        return results
+
+    def test_compare(self):
+        self.assertEqual(self.evaluate('pctused > 90'), [False, True, True])
+        self.evaluate('90 < pctused')
+        self.evaluate('pctused >= 91.0')
+        self.evaluate("name == '/var'")
+        self.evaluate('avail < pctused')
+        self.evaluate('0 < avail <= 900')
+
+    def test_boolean(self):
+        self.assertEqual(self.evaluate('pctused > 90 and avail < 1000'), [False, True, False])
+        self.evaluate('pctused > 90 or avail < 1000')
+        self.evaluate("not (pctused > 90 and name != '/home')")
+        self.evaluate('True')
+        self.evaluate('False')
+
+    def test_not_vectorised(self):
+        self.assertTrue(table.TableRule.fromRule('pctused') is None)
+        self.assertTrue(table.TableRule.fromRule('pctused + 1 > 90') is None)
+        self.assertTrue(table.TableRule.fromRule('name in ("/", "/var")') is None)
+        self.assertTrue(table.TableRule.fromRule('f(pctused) > 1') is None)
+        self.assertTrue(table.TableRule.fromRule('pctused >') is None)
+
+    def test_missing_column(self):
+        tr = table.TableRule.fromRule('missing > 90')
+        self.assertTrue(tr.evaluate(ROWS) is None)
+
+    def test_pattern(self):
+        self.assertTrue(table.isPattern('*'))
+        self.assertTrue(table.isPattern('sd?'))
+        self.assertFalse(table.isPattern('/var'))
+        self.assertFalse(table.isPattern(None))
+        self.assertTrue(table.match('/var*', '/', '/var/log'))
+        self.assertFalse(table.match('sd*', 'hda', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -38,6 +38,71 @@ class ParseVarsTest(unittest.TestCase):
         d['wbytes'] = 200000
         self.assertEqual(utils.parse_vars("{device} rbytes={rbytes:fmt.bc}, wbytes=%(wbytes)s", d), "disk0 rbytes=97.7 K, wbytes=200000")
 
+    def test_same_as_percent(self):
+        d = {'x': 3.14159, 'n': 42, 's': 'str'}
+        for text in ("%(x).2f %(n)05d %(s)-5s|", "100%% of %(n)d", "%(n)r %(s)r", "no vars %%"):
+            self.assertEqual(utils.parse_vars(text, d), text % d)
+        self.assertEqual(utils.parse_vars("%(missing)s", d), "%(missing)s")
+        self.assertEqual(utils.parse_vars("%(s)d", d), "%(s)d")
+        self.assertRaises(ValueError, utils.parse_vars, "100%", d)
+
+    def test_compiled_once(self):
+        text = "%(h)s load=%(load).1f"
+        template = utils.percent_template(text)
+        self.assertEqual(template.segments[0], ('', 'h', 's'))
+        self.assertTrue(utils.percent_template(text) is template)
+        self.assertEqual(utils.percent_template("static %% text").static, "static % text")
+        self.assertTrue(utils.percent_template("%s").segments is None)
+
+    def test_parse_vars_list(self):
+        ds = [{'h': 'a', 'v': 1}, {'h': 'b', 'v': 2}]
+        self.assertEqual(utils.parse_vars_list("%(h)s={v}", ds), ['a=1', 'b=2'])
+        self.assertEqual(utils.parse_vars_list("static", ds), ['static', 'static'])
+
+
+class VarContextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.defaults = {'h': 'host1', 'rule': 'x > 1'}
+        self.data = {'x': 2, 'rule': 'overridden'}
+
+    def tearDown(self):
+        pass
+
+    def test_layer_precedence(self):
+        ctx = utils.VarContext(self.defaults, self.data)
+        self.assertEqual(ctx['rule'], 'x > 1')
+        self.assertEqual(ctx['x'], 2)
+        self.assertEqual(sorted(ctx.keys()), ['h', 'rule', 'x'])
+        self.assertEqual(len(ctx), 3)
+
+    def test_assignment_does_not_touch_layers(self):
+        ctx = utils.VarContext(self.defaults, self.data)
+        ctx['actnm'] = 'actions'
+        ctx['x'] = 3
+        self.assertEqual(ctx['x'], 3)
+        self.assertEqual(self.data, {'x': 2, 'rule': 'overridden'})
+        self.assertNotIn('actnm', self.defaults)
+        del ctx['x']
+        self.assertEqual(ctx['x'], 2)
+
+    def test_missing_key(self):
+        ctx = utils.VarContext(self.defaults, None)
+        with self.assertRaises(KeyError):
+            ctx['x']
+        self.assertEqual(ctx.get('x'), None)
+
+    def test_eval_and_substitution(self):
+        ctx = utils.VarContext(self.defaults, self.data)
+        self.assertTrue(eval('x > 1', {}, ctx))
+        self.assertEqual(utils.parse_vars("%(h)s x=%(x)s {h}", ctx), 'host1 x=2 host1')
+
+    def test_new_child(self):
+        ctx = utils.VarContext(self.data)
+        child = ctx.new_child({'x': 5})
+        self.assertEqual(child['x'], 5)
+        self.assertEqual(ctx['x'], 2)
+
 
 class ByteConvertorTest(unittest.TestCase):
 